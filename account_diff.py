@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+import numpy as np
+import pandas as pd
+from eosio_asset import format_amounts
+
+
+# Statuses in the order they are checked, an account gets the first that applies
+MISSING = 'missing'
+EXTRA = 'extra'
+KEY_MISMATCH = 'key_mismatch'
+BALANCE_MISMATCH = 'balance_mismatch'
+STATUSES = [MISSING, EXTRA, KEY_MISMATCH, BALANCE_MISMATCH]
+FIELDS = ['category', 'eos_account', 'status', 'eos_key', 'chain_key', 'balance', 'chain_balance', 'difference']
+CHUNK_ROWS = 100000
+
+
+class DiffWriter:
+    # Mismatches are written as they are found, as JSON lines when the file
+    # name ends in .jsonl and csv otherwise. Only the counts per category and
+    # status, plus the first few rows of each category, stay in memory
+
+    def __init__(self, filename, samples=10):
+        self.filename = filename
+        self.jsonl = filename.endswith('.jsonl')
+        self.samples = samples
+        self.counts = {}
+        self.totals = {}
+        self.first = {}
+        self.fout = open(filename, 'w', newline='')
+        if not self.jsonl:
+            self.writer = csv.writer(self.fout)
+            self.writer.writerow(FIELDS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def checked(self, category, count):
+        self.totals[category] = self.totals.get(category, 0) + count
+
+    def write(self, rows):
+        # rows is a frame with the FIELDS columns
+        for (category, status), count in rows.groupby(['category', 'status']).size().items():
+            key = (category, status)
+            self.counts[key] = self.counts.get(key, 0) + int(count)
+        for category, group in rows.groupby('category'):
+            first = self.first.setdefault(category, [])
+            if len(first) < self.samples:
+                first.extend(group.head(self.samples - len(first)).to_dict('records'))
+
+        records = rows[FIELDS].itertuples(index=False, name=None)
+        if self.jsonl:
+            self.fout.writelines(json.dumps(dict(zip(FIELDS, record))) + '\n' for record in records)
+        else:
+            self.writer.writerows(records)
+
+    def summary(self, category):
+        return {status: self.counts.get((category, status), 0) for status in STATUSES}
+
+    def close(self):
+        self.fout.close()
+
+
+def diff_chunk(expected, chain, tolerance):
+    # expected has category, eos_account, eos_key, balance and the check_key and
+    # check_balance flags, chain is indexed by account with eos_key, balance and
+    # exists. Returns the rows that don't match
+    merged = expected.join(chain, on='eos_account', rsuffix='_chain')
+    exists = merged['exists'].eq(True).to_numpy()
+    expected_balance = merged['balance'].to_numpy(dtype=np.int64)
+    chain_balance = merged['balance_chain'].fillna(0).to_numpy(dtype=np.int64)
+    difference = chain_balance - expected_balance
+    key_mismatch = merged['check_key'].to_numpy(dtype=bool) & \
+        (merged['eos_key'].to_numpy() != merged['eos_key_chain'].to_numpy())
+    balance_mismatch = merged['check_balance'].to_numpy(dtype=bool) & (np.abs(difference) > tolerance)
+
+    status = np.select([~exists, key_mismatch, balance_mismatch],
+                       [MISSING, KEY_MISMATCH, BALANCE_MISMATCH], '')
+    failed = status != ''
+    chain_key = merged['eos_key_chain'].where(exists, '').fillna('')
+    return pd.DataFrame({
+        'category': merged['category'].to_numpy()[failed],
+        'eos_account': merged['eos_account'].to_numpy()[failed],
+        'status': status[failed],
+        'eos_key': merged['eos_key'].to_numpy()[failed],
+        'chain_key': chain_key.to_numpy()[failed],
+        'balance': format_amounts(expected_balance[failed]),
+        'chain_balance': np.where(exists[failed], format_amounts(chain_balance[failed]), ''),
+        'difference': np.where(exists[failed], format_amounts(difference[failed]), ''),
+    })
+
+
+def diff_extra(expected, chain, category='chain'):
+    # Accounts on chain that no category expects
+    extra = chain[chain['exists'].eq(True) & ~chain.index.isin(expected['eos_account'])]
+    return pd.DataFrame({
+        'category': category,
+        'eos_account': extra.index.to_numpy(),
+        'status': EXTRA,
+        'eos_key': '',
+        'chain_key': extra['eos_key'].fillna('').to_numpy(),
+        'balance': '',
+        'chain_balance': format_amounts(extra['balance'].to_numpy(dtype=np.int64)),
+        'difference': format_amounts(extra['balance'].to_numpy(dtype=np.int64)),
+    }, columns=FIELDS)
+
+
+def diff_accounts(expected, chain, writer, tolerance=0, chunk_rows=CHUNK_ROWS):
+    # Key aligned diff of the expected accounts against the chain state, a
+    # missing account only ever affects its own row. Balances within
+    # tolerance units of each other match
+    for pos in range(0, len(expected), chunk_rows):
+        chunk = expected.iloc[pos:pos + chunk_rows]
+        for category, count in chunk['category'].value_counts(sort=False).items():
+            writer.checked(category, int(count))
+        rows = diff_chunk(chunk, chain, tolerance)
+        if len(rows):
+            writer.write(rows)
+    rows = diff_extra(expected, chain)
+    if len(rows):
+        writer.write(rows)
+    return writer
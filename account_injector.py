@@ -7,6 +7,19 @@ import colorlog
 import inspect
 import eospy.cleos
 import pandas
+import json
+import time
+import threading
+import requests
+import metrics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from eosio_serializer import AbiSerializer
+from eosio_transaction import Signer, TransactionBuilder, parse_block_time
+from transaction_spool import SpoolWriter, read_header, read_spool, verify_spool
+from chain_client import ChainError
+from eosio_asset import parse_amounts, split_genesis, format_asset
+from snapshot_format import Snapshot, is_snapshot_file
 
 
 SCRIPT_PATH = os.path.dirname(os.path.abspath(
@@ -20,12 +33,49 @@ parser.add_argument("-d", '--debug', action="store_true",
 parser.add_argument('-l', '--log_file', default='{}.log'.format(
     os.path.basename(__file__).split('.')[0]), help='Log file')
 parser.add_argument('-s', '--snapshot_file',
-                    default='{}/eosmetal_telos_snapshot.csv'.format(SCRIPT_PATH), help='Snapshot file')
+                    default='{}/eosmetal_telos_snapshot.bin'.format(SCRIPT_PATH), help='Snapshot file (binary or csv)')
 parser.add_argument('-u', '--api_endpoint',
                     default='http://127.0.0.1:8888', help='EOSIO API endpoint URI')
 parser.add_argument('-b', '--batch_size', type=int,
-                    default=200, help='Number of actions per transaction')
+                    default=200, help='Initial number of accounts per transaction')
+parser.add_argument('--max_batch_size', type=int,
+                    default=2000, help='Maximum number of accounts per transaction')
+parser.add_argument('--cpu_share', type=float, default=0.5,
+                    help='Share of the CPU limit each transaction targets (0 keeps the batch size fixed)')
+parser.add_argument('--cpu_limit_us', type=int, default=0,
+                    help='CPU limit in us to size transactions against (defaults to the chain max_block_cpu_usage)')
+parser.add_argument('-p', '--in_flight', type=int,
+                    default=4, help='Number of transactions in flight')
+parser.add_argument('-r', '--retries', type=int,
+                    default=3, help='Number of retries for a failed transaction')
+parser.add_argument('-j', '--journal_file', default='{}.journal'.format(
+    os.path.basename(__file__).split('.')[0]), help='Journal of committed batches')
+parser.add_argument('--resume', action="store_true",
+                    dest="resume", help='Skip the batches already committed in the journal')
+parser.add_argument('--sign_workers', type=int, default=0,
+                    help='Signing processes when coincurve is not installed (defaults to the CPU count)')
+parser.add_argument('--tapos_refresh', type=float, default=60,
+                    help='Seconds the chain id and reference block are cached for')
+parser.add_argument('--expiration', type=int, default=120,
+                    help='Seconds until a transaction expires')
+parser.add_argument('--spool_out',
+                    help='Sign every batch into this spool file ahead of time instead of pushing')
+parser.add_argument('--spool_in',
+                    help='Push the signed transactions of this spool file')
+parser.add_argument('--spool_push', type=int, default=50,
+                    help='Spooled transactions per push_transactions call')
+parser.add_argument('--chain_id',
+                    help='Chain id to sign the spool for without asking the node, '
+                    'the reference block is then block 0, valid until block 65536')
+parser.add_argument('--expires_at',
+                    help='UTC time spooled transactions expire at, as YYYY-MM-DDTHH:MM:SS, '
+                    'required with --spool_out. Replay raises max_transaction_lifetime while it pushes if it falls short')
+parser.add_argument('--abi_dir',
+                    help='Directory with eosio.abi and eosio.token.abi, read instead of asking the node')
+metrics.add_arguments(parser)
 args = parser.parse_args()
+if args.spool_out and not args.expires_at:
+    parser.error('--spool_out needs --expires_at, the spool has to outlive the wait for the boot window')
 
 VERBOSE = args.verbose
 DEBUG = args.debug
@@ -33,6 +83,22 @@ SNAPSHOT_FILE = args.snapshot_file
 LOG_FILE = args.log_file
 API_ENDPOINT = args.api_endpoint
 BATCH_SIZE = int(args.batch_size)
+MAX_BATCH_SIZE = int(args.max_batch_size)
+CPU_SHARE = float(args.cpu_share)
+CPU_LIMIT_US = int(args.cpu_limit_us)
+IN_FLIGHT = int(args.in_flight)
+RETRIES = int(args.retries)
+JOURNAL_FILE = args.journal_file
+RESUME = args.resume
+SIGN_WORKERS = int(args.sign_workers)
+TAPOS_REFRESH = float(args.tapos_refresh)
+EXPIRATION = int(args.expiration)
+SPOOL_OUT = args.spool_out
+SPOOL_IN = args.spool_in
+SPOOL_PUSH = int(args.spool_push)
+CHAIN_ID = args.chain_id
+EXPIRES_AT = args.expires_at
+ABI_DIR = args.abi_dir
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -52,15 +118,122 @@ logger.addHandler(fh)
 RAM_KB = 4 
 SYMBOL = "TLOS"
 KEY = "5JRiK3ctuSgPwEsFvY1FeCxW6VHYcGo3h28YkyJYBnEBvtgrhPd"
+RESOURCE_ERRORS = ['deadline_exception', 'tx_cpu_usage_exceeded', 'block_cpu_usage_exceeded',
+                   'tx_net_usage_exceeded', 'block_net_usage_exceeded']
 SCRIPT_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
 cleos = eospy.cleos.Cleos(url=API_ENDPOINT)
+serializers = {}
+sessions = threading.local()
+builder = None
 
 
-def chunker(seq, size):
-    return (seq[pos:pos + size] for pos in range(0, len(seq), size))
+class Journal:
+    # Append-only record of submitted and committed batches, one JSON object per line
 
-def get_account_creation_actions(account, balance, key):
+    def __init__(self, filename, resume):
+        self.params = None
+        self.committed = []
+        self.in_doubt = []
+        if resume and os.path.exists(filename):
+            self._load(filename)
+        self.file = open(filename, 'a' if resume else 'w')
+
+    def _load(self, filename):
+        pending = {}
+        with open(filename) as fin:
+            for line in fin:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash
+                    continue
+                if record['status'] == 'params':
+                    self.params = record['params']
+                elif record['status'] == 'pending':
+                    pending[(record['start'], record['end'])] = record
+                elif record['status'] == 'split':
+                    pending.pop((record['start'], record['end']), None)
+                else:
+                    pending.pop((record['start'], record['end']), None)
+                    self.committed.append((record['start'], record['end']))
+        self.in_doubt = sorted(pending)
+
+    def write(self, record):
+        self.file.write('{}\n'.format(json.dumps(record)))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def save_params(self, params):
+        self.params = params
+        self.write({'status': 'params', 'params': params})
+
+    def pending(self, start, end):
+        self.write({'status': 'pending', 'start': start, 'end': end})
+
+    def split(self, start, end):
+        self.write({'status': 'split', 'start': start, 'end': end})
+
+    def commit(self, start, end, trx_id, block_num, status='committed'):
+        self.committed.append((start, end))
+        self.write({'status': status, 'start': start, 'end': end,
+                    'trx_id': trx_id, 'block_num': block_num})
+
+
+class BatchSizer:
+    # Sizes batches from the CPU and NET each account took in the last receipts
+
+    def __init__(self, size, max_size, cpu_limit_us, net_limit_bytes, share):
+        self.size = size
+        self.max_size = max_size
+        self.cpu_limit_us = cpu_limit_us
+        self.net_limit_bytes = net_limit_bytes
+        self.share = share
+
+    def update(self, num_accounts, cpu_usage_us, net_usage_words):
+        if self.share <= 0 or num_accounts == 0:
+            return
+        target = self.cpu_limit_us * self.share / max(cpu_usage_us / num_accounts, 1)
+        if self.net_limit_bytes:
+            target = min(target, self.net_limit_bytes * self.share / max(net_usage_words * 8 / num_accounts, 1))
+        # Grow at most twice per step, a cold node can be misleadingly fast
+        size = max(1, min(int(target), self.size * 2, self.max_size))
+        if size != self.size:
+            logger.debug('Batch size {} -> {} ({} us for {} accounts)'.format(
+                self.size, size, cpu_usage_us, num_accounts))
+        self.size = size
+
+    def back_off(self, failed_size):
+        # The node can't take failed_size accounts, never grow back to it
+        self.max_size = max(1, min(self.max_size, failed_size - 1))
+        self.size = max(1, min(self.size, failed_size) // 2)
+        logger.warning('Backing off batch size to {}'.format(self.size))
+
+
+def get_batches(num_accounts, committed, sizer):
+    start = 0
+    for (committed_start, committed_end) in sorted(committed) + [(num_accounts, num_accounts)]:
+        pos = start
+        while pos < committed_start:
+            end = min(pos + sizer.size, committed_start)
+            yield pos, end
+            pos = end
+        start = max(start, committed_end)
+
+def load_abis():
+    for account in ['eosio', 'eosio.token']:
+        if ABI_DIR:
+            with open(os.path.join(ABI_DIR, account + '.abi')) as fin:
+                abi = json.load(fin)
+        else:
+            with metrics.timer('rpc_seconds', method='get_abi'):
+                abi = cleos.get_abi(account)['abi']
+        serializers[account] = AbiSerializer(abi)
+
+def abi_json_to_bin(code, action, args):
+    return serializers[code].encode_action(action, args)
+
+def get_account_creation_actions(account, key, liquid, delegate_cpu, delegate_net):
     # Create new account tx
     owner_active_auth = {
         "threshold": 1,
@@ -77,7 +250,7 @@ def get_account_creation_actions(account, balance, key):
         'owner': owner_active_auth, 
         'active': owner_active_auth
     }
-    newaccount_data = cleos.abi_json_to_bin('eosio', 'newaccount', newaccount_payload)
+    newaccount_data = abi_json_to_bin('eosio', 'newaccount', newaccount_payload)
     newaccount_action = {
         'account' : 'eosio',
         'name' : 'newaccount',
@@ -86,7 +259,7 @@ def get_account_creation_actions(account, balance, key):
             'actor' : 'eosio',
             'permission' : 'active'
         } ],
-        'data' : newaccount_data['binargs']
+        'data' : newaccount_data
     }
 
     # Create buy ram tx
@@ -95,7 +268,7 @@ def get_account_creation_actions(account, balance, key):
         'receiver':account, 
         'bytes': RAM_KB*1024
     }
-    buyram_data = cleos.abi_json_to_bin('eosio', 'buyrambytes', buyram_payload)
+    buyram_data = abi_json_to_bin('eosio', 'buyrambytes', buyram_payload)
     buyram_action = {
         'account' : 'eosio',
         'name' : 'buyrambytes',
@@ -104,31 +277,18 @@ def get_account_creation_actions(account, balance, key):
                 'actor' : 'eosio',
                 'permission' : 'active'
             } ],
-        'data' : buyram_data['binargs']
+        'data' : buyram_data
     }
 
     # Create delegatebw tx
-    f_balance = float(balance)
-    f_balance = float(balance)
-    if f_balance < 3:
-        liquid = 0.1
-    elif f_balance <= 11:
-        liquid = 2.0
-    else:
-        liquid = 10.0
-    
-    remainder = f_balance - liquid
-    delegate_cpu = round(remainder / 2, 4)
-    delegate_net = remainder - delegate_cpu
-
     delegate_payload = {
         'from': 'eosio', 
         'receiver': account, 
-        'stake_net_quantity': '{:.4f} {}'.format(delegate_net, SYMBOL), 
-        'stake_cpu_quantity': '{:.4f} {}'.format(delegate_cpu, SYMBOL), 
+        'stake_net_quantity': format_asset(delegate_net, SYMBOL), 
+        'stake_cpu_quantity': format_asset(delegate_cpu, SYMBOL), 
         'transfer': True 
     }
-    delegate_data = cleos.abi_json_to_bin('eosio', 'delegatebw', delegate_payload)
+    delegate_data = abi_json_to_bin('eosio', 'delegatebw', delegate_payload)
     delegate_action = {
         'account' : 'eosio',
         'name' : 'delegatebw',
@@ -137,18 +297,18 @@ def get_account_creation_actions(account, balance, key):
                 'actor' : 'eosio',
                 'permission' : 'active'
             } ],
-        'data' : delegate_data['binargs']
+        'data' : delegate_data
     }
 
     # Create transfer tx
     transfer_payload = {
         "from": "eosio", 
         "to": account, 
-        "quantity": '{:.4f} {}'.format(liquid, SYMBOL), 
+        "quantity": format_asset(liquid, SYMBOL), 
         "memo": "transfer genesis balance to {}".format(account)
     }
     
-    transfer_data = cleos.abi_json_to_bin('eosio.token', 'transfer', transfer_payload)
+    transfer_data = abi_json_to_bin('eosio.token', 'transfer', transfer_payload)
     transfer_action = {
         "account": "eosio.token", 
         "name": "transfer", 
@@ -157,18 +317,33 @@ def get_account_creation_actions(account, balance, key):
                 "actor": "eosio", 
                 "permission": "active"
             }], 
-        "data": transfer_data['binargs']}
+        "data": transfer_data}
 
     return (newaccount_action, buyram_action, delegate_action, transfer_action)
 
+def load_snapshot(filename):
+    if is_snapshot_file(filename):
+        # Keys stay binary, the serializer packs them as they are
+        snapshot = Snapshot(filename)
+        telos_genesis = pandas.DataFrame({'eos_account': snapshot.accounts(),
+                                          'eos_key': snapshot.key_bytes()})
+        balances = snapshot.balances
+    else:
+        telos_genesis = pandas.read_csv(filename, dtype=str, names=['eth_address',
+                                                                    'eos_account', 'eos_key', 'balance'])
+        balances = parse_amounts(telos_genesis['balance'])
+    telos_genesis['liquid'], telos_genesis['cpu'], telos_genesis['net'] = split_genesis(balances)
+    return telos_genesis
+
 def get_chain_params():
-    return cleos.get_table('eosio', 'eosio', 'global')['rows'][0]
+    with metrics.timer('rpc_seconds', method='get_table_rows'):
+        return cleos.get_table('eosio', 'eosio', 'global')['rows'][0]
 
 def set_chain_params(params):
     set_params_payload = {
         'params': params 
     }
-    set_params_data = cleos.abi_json_to_bin('eosio', 'setparams', set_params_payload)
+    set_params_data = abi_json_to_bin('eosio', 'setparams', set_params_payload)
     set_params_action = {
         'account' : 'eosio',
         'name' : 'setparams',
@@ -177,66 +352,451 @@ def set_chain_params(params):
                 'actor' : 'eosio',
                 'permission' : 'active'
             } ],
-        'data' : set_params_data['binargs']
+        'data' : set_params_data
     }
-    trx = {"actions": [set_params_action]}
-    return cleos.push_transaction(trx, KEY, broadcast=True)
+    return push_transaction([set_params_action])
 
-def main():
+def post(method, payload):
+    # One keep-alive session per push thread
+    session = getattr(sessions, 'session', None)
+    if session is None:
+        session = sessions.session = requests.Session()
+    with metrics.timer('rpc_seconds', method=method):
+        resp = session.post('{}/v1/chain/{}'.format(API_ENDPOINT, method), json=payload, timeout=30)
+    if resp.status_code != 200:
+        # Same message eospy raised, is_resource_error looks into it
+        raise ChainError('Error: {}'.format(resp.text))
+    return resp.json()
+
+def offline_info():
+    # The summary of block 0 stays all zeros until block 65536 replaces it
+    return {'chain_id': CHAIN_ID, 'head_block_num': 0, 'last_irreversible_block_num': 0,
+            'last_irreversible_block_id': '00' * 32,
+            'head_block_time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())}
+
+def push_transaction(actions):
+    # The TAPOS reference is cached by the builder, so pushing is the only round trip
+    with metrics.timer('sign_seconds'):
+        trx, _ = builder.build(actions)
+    return post('push_transaction', trx)
+
+def get_batch_actions(batch):
+    actions = []
+    with metrics.timer('serialize_seconds'):
+        for account, key, liquid, cpu, net in zip(batch['eos_account'], batch['eos_key'],
+                                                  batch['liquid'], batch['cpu'], batch['net']):
+            actions.extend(get_account_creation_actions(account, key, liquid, cpu, net))
+    return actions
+
+def push_batch(batch):
+    return push_transaction(get_batch_actions(batch))
+
+def is_account_on_chain(account):
+    try:
+        with metrics.timer('rpc_seconds', method='get_account'):
+            cleos.get_account(account)
+    except Exception as e:
+        if 'unknown key' in str(e):
+            return False
+        raise
+    return True
+
+def is_confirmed_on_chain(account):
+    # False when the check itself fails, that is no reason to give up on the
+    # retries left. Pushing again makes the node tell if it was there after all
+    try:
+        return is_account_on_chain(account)
+    except Exception as e:
+        logger.warning('Error checking whether {} is on chain: {}'.format(account, e))
+        return False
+
+def is_batch_on_chain(batch):
+    # Transactions are atomic, so the last account of the batch tells for the whole batch
+    return is_account_on_chain(batch['eos_account'].iloc[-1])
+
+def check_in_doubt(telos_genesis, journal):
+    for start, end in journal.in_doubt:
+        if is_batch_on_chain(telos_genesis.iloc[start:end]):
+            logger.info('Accounts {} to {} already on chain'.format(start, end - 1))
+            journal.commit(start, end, None, None, status='verified')
+        else:
+            logger.info('Accounts {} to {} not on chain, pushing them again'.format(start, end - 1))
+
+def is_resource_error(e):
+    return any(error in str(e) for error in RESOURCE_ERRORS)
+
+def wait_batch(executor, start, end, batch, future):
+    # Retries happen before any later batch is accounted, so logs stay in snapshot order
+    attempt = 0
+    while True:
+        try:
+            return future.result()
+        except Exception as e:
+            if attempt >= RETRIES or is_resource_error(e):
+                raise
+            attempt += 1
+            metrics.inc('push_retries')
+            logger.warning('Error pushing accounts {} to {}, retrying ({}/{}): {}'.format(
+                start, end - 1, attempt, RETRIES, e))
+            if is_confirmed_on_chain(batch['eos_account'].iloc[-1]):
+                return None
+            future = executor.submit(push_batch, batch)
+
+def settle_batch(executor, telos_genesis, journal, sizer, start, end, future):
+    batch = telos_genesis.iloc[start:end]
+    try:
+        resp = wait_batch(executor, start, end, batch, future)
+    except Exception as e:
+        if end - start <= 1 or not is_resource_error(e):
+            raise
+        sizer.back_off(end - start)
+        metrics.inc('batch_splits')
+        logger.warning('Accounts {} to {} exceed the transaction limits, splitting them'.format(start, end - 1))
+        journal.split(start, end)
+        step = sizer.size
+        for sub_start in range(start, end, step):
+            sub_end = min(sub_start + step, end)
+            journal.pending(sub_start, sub_end)
+            settle_batch(executor, telos_genesis, journal, sizer, sub_start, sub_end,
+                         executor.submit(push_batch, telos_genesis.iloc[sub_start:sub_end]))
+        return
+
+    if resp is None:
+        journal.commit(start, end, None, None, status='verified')
+        return
+    receipt = resp['processed']['receipt']
+    journal.commit(start, end, resp['transaction_id'], resp['processed']['block_num'])
+    sizer.update(end - start, receipt['cpu_usage_us'], receipt['net_usage_words'])
+    metrics.observe('transaction_cpu_seconds', receipt['cpu_usage_us'] / 1e6)
+    metrics.gauge('batch_size', sizer.size)
+    logger.debug('Accounts {} to {} in transaction {}'.format(
+        start, end - 1, resp['transaction_id']))
+
+def create_accounts(telos_genesis, journal, sizer):
+    num_accounts = len(telos_genesis.index)
+    created_accounts = sum(end - start for start, end in journal.committed)
+    pending = deque()
+    started, resumed_at = time.monotonic(), created_accounts
+    metrics.gauge('accounts_total', num_accounts)
+
+    def finish_oldest():
+        nonlocal created_accounts
+        start, end, future = pending.popleft()
+        settle_batch(executor, telos_genesis, journal, sizer, start, end, future)
+        created_accounts += end - start
+        rate = (created_accounts - resumed_at) / max(time.monotonic() - started, 1e-6)
+        eta = (num_accounts - created_accounts) / rate if rate else 0
+        metrics.gauge('accounts_created', created_accounts)
+        metrics.gauge('accounts_per_second', round(rate, 1))
+        metrics.gauge('eta_seconds', round(eta))
+        logger.info('Created {} accounts of {}, {:.0f} accounts/s, ETA {}'.format(
+            created_accounts, num_accounts, rate, time.strftime('%H:%M:%S', time.gmtime(eta))))
+
+    with ThreadPoolExecutor(max_workers=IN_FLIGHT) as executor:
+        try:
+            for start, end in get_batches(num_accounts, journal.committed, sizer):
+                journal.pending(start, end)
+                pending.append((start, end, executor.submit(push_batch, telos_genesis.iloc[start:end])))
+                if len(pending) >= IN_FLIGHT:
+                    finish_oldest()
+            while pending:
+                finish_oldest()
+        except Exception:
+            for _, _, future in pending:
+                future.cancel()
+            raise
+
+def write_spool(telos_genesis, filename):
+    # Signs fixed size batches on a pool of threads, written in snapshot order
+    num_accounts = len(telos_genesis.index)
+    expires_at = parse_block_time(EXPIRES_AT)
+    context = builder.chain_context()
+    if expires_at <= time.time() + context['clock_offset']:
+        raise ValueError('Expiration {} is already past'.format(EXPIRES_AT))
+    header = {'chain_id': context['chain_id'], 'ref_block': context['ref_block'],
+              'accounts': num_accounts, 'batch_size': BATCH_SIZE,
+              'expires_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(expires_at)),
+              'snapshot': os.path.basename(SNAPSHOT_FILE),
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())}
+    workers = SIGN_WORKERS or os.cpu_count()
+
+    def sign_batch(start, end):
+        batch = telos_genesis.iloc[start:end]
+        actions = get_batch_actions(batch)
+        with metrics.timer('sign_seconds'):
+            trx, _ = builder.build(actions, expires_at)
+        return start, end, batch['eos_account'].iloc[-1], trx
+
+    with SpoolWriter(filename, header) as writer, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        def write_oldest():
+            start, end, last_account, trx = pending.popleft().result()
+            writer.write(start, end, last_account, trx)
+            metrics.gauge('accounts_signed', end)
+            if writer.count % 100 == 0 or end == num_accounts:
+                logger.info('Signed {} accounts of {}'.format(end, num_accounts))
+
+        for start in range(0, num_accounts, BATCH_SIZE):
+            pending.append(executor.submit(sign_batch, start, min(start + BATCH_SIZE, num_accounts)))
+            if len(pending) >= workers * 2:
+                write_oldest()
+        while pending:
+            write_oldest()
+        return writer.count
+
+def check_spool_in_doubt(filename, journal):
+    in_doubt = set(journal.in_doubt)
+    for start, end, last_account, _ in read_spool(filename):
+        if (start, end) not in in_doubt:
+            continue
+        if is_account_on_chain(last_account):
+            logger.info('Accounts {} to {} already on chain'.format(start, end - 1))
+            journal.commit(start, end, None, None, status='verified')
+        else:
+            logger.info('Accounts {} to {} not on chain, pushing them again'.format(start, end - 1))
+
+def push_spooled(records):
+    return post('push_transactions', [trx for _, _, _, trx in records])
+
+def settle_spooled(executor, journal, records, future):
+    # Returns the number of accounts committed. nodeos goes on with the rest
+    # of a push_transactions call when one fails, so failures are raised only
+    # once every other result is in the journal
+    attempt = 0
+    verified = 0
+    while True:
+        try:
+            results = future.result()
+            break
+        except Exception as e:
+            if attempt >= RETRIES:
+                raise
+            attempt += 1
+            metrics.inc('push_retries')
+            logger.warning('Error pushing accounts {} to {}, retrying ({}/{}): {}'.format(
+                records[0][0], records[-1][1] - 1, attempt, RETRIES, e))
+            remaining = []
+            for start, end, last_account, trx in records:
+                if is_confirmed_on_chain(last_account):
+                    journal.commit(start, end, None, None, status='verified')
+                    verified += end - start
+                else:
+                    remaining.append((start, end, last_account, trx))
+            records = remaining
+            if not records:
+                return verified
+            future = executor.submit(push_spooled, records)
+
+    created, errors = verified, []
+    for (start, end, last_account, _), result in zip(records, results):
+        processed = result['processed']
+        error = processed.get('error') or processed.get('except')
+        if error is None:
+            journal.commit(start, end, result['transaction_id'], processed['block_num'])
+        elif 'tx_duplicate' in str(error) or is_confirmed_on_chain(last_account):
+            journal.commit(start, end, None, None, status='verified')
+        else:
+            errors.append('accounts {} to {}: {}'.format(start, end - 1, error))
+            continue
+        created += end - start
+    if errors:
+        raise ChainError('Error: {}'.format('; '.join(errors)))
+    return created
+
+def push_spool(filename, header, journal):
+    # Nothing is built or signed here, spooled transactions go out as they are
+    # read, SPOOL_PUSH per call and IN_FLIGHT calls at a time
+    num_accounts = header['accounts']
+    committed = set(journal.committed)
+    created_accounts = sum(end - start for start, end in committed)
+    pending = deque()
+    started, resumed_at = time.monotonic(), created_accounts
+    metrics.gauge('accounts_total', num_accounts)
+
+    def finish_oldest():
+        nonlocal created_accounts
+        records, future = pending.popleft()
+        created_accounts += settle_spooled(executor, journal, records, future)
+        rate = (created_accounts - resumed_at) / max(time.monotonic() - started, 1e-6)
+        eta = (num_accounts - created_accounts) / rate if rate else 0
+        metrics.gauge('accounts_created', created_accounts)
+        metrics.gauge('accounts_per_second', round(rate, 1))
+        metrics.gauge('eta_seconds', round(eta))
+        logger.info('Created {} accounts of {}, {:.0f} accounts/s, ETA {}'.format(
+            created_accounts, num_accounts, rate, time.strftime('%H:%M:%S', time.gmtime(eta))))
+
+    def submit(records):
+        for start, end, _, _ in records:
+            journal.pending(start, end)
+        pending.append((records, executor.submit(push_spooled, records)))
+        if len(pending) >= IN_FLIGHT:
+            finish_oldest()
+
+    with ThreadPoolExecutor(max_workers=IN_FLIGHT) as executor:
+        try:
+            records = []
+            for record in read_spool(filename):
+                if record[:2] in committed:
+                    continue
+                records.append(record)
+                if len(records) >= SPOOL_PUSH:
+                    submit(records)
+                    records = []
+            if records:
+                submit(records)
+            while pending:
+                finish_oldest()
+        except Exception:
+            for _, future in pending:
+                future.cancel()
+            raise
+    if created_accounts != num_accounts:
+        raise ChainError('Only {} accounts of {} were created'.format(created_accounts, num_accounts))
+
+def load_inputs():
     try:
-        telos_genesis = pandas.read_csv(SNAPSHOT_FILE, dtype=str, names=['eth_address',
-                                                                         'eos_account', 'eos_key', 'balance'])
+        telos_genesis = load_snapshot(SNAPSHOT_FILE)
     except Exception as e:
         logger.critical(
             'Error loading snapshot at {}: {}'.format(SNAPSHOT_FILE, e))
         exit(1)
 
-    logging.info('Creating accounts')
-    created_accounts = 0
-    num_accounts = len(telos_genesis.index)
+    try:
+        load_abis()
+    except Exception as e:
+        logger.critical('Error loading contract ABIs: {}'.format(e))
+        exit(1)
+    return telos_genesis
 
-    #Set chain params to max performance
+def open_journal(check):
+    journal = Journal(JOURNAL_FILE, RESUME)
+    if RESUME:
+        logger.info('Resuming from journal {}'.format(JOURNAL_FILE))
+        try:
+            check(journal)
+        except Exception as e:
+            logger.critical('Error checking in doubt accounts: {}'.format(e))
+            exit(1)
+    return journal
+
+def with_max_performance(journal, create, lifetime=0):
+    # Runs create(global_params) with the chain CPU limits raised, restoring them after.
+    # max_transaction_lifetime goes up to lifetime seconds too if it is shorter
     logger.info('Setting chain params to max performance')
     global_params = get_chain_params()
+    if journal.params is None:
+        journal.save_params(global_params.copy())
+    else:
+        #A previous run may have died with the chain params already raised
+        global_params = journal.params.copy()
     max_block_cpu_usage  = global_params['max_block_cpu_usage']
     max_transaction_cpu_usage = global_params['max_transaction_cpu_usage']
+    max_transaction_lifetime = global_params['max_transaction_lifetime']
+    original_params = global_params.copy()
     global_params['max_block_cpu_usage'] = 100000000
     global_params['max_transaction_cpu_usage'] = 99999899
+    if lifetime > max_transaction_lifetime:
+        logger.info('Raising max_transaction_lifetime to {} seconds'.format(lifetime))
+        global_params['max_transaction_lifetime'] = lifetime
 
     try:     
         set_chain_params(global_params)
     except Exception as e:
         logger.critical('Error setting chain params: {}'.format(e))
-        quit()
+        exit(1)
     
     #Create accounts
-    for i in chunker(telos_genesis, BATCH_SIZE):
-        actions = []
-        for _, row in i.iterrows():
-            actions.extend(get_account_creation_actions(
-                row['eos_account'], row['balance'], row['eos_key']))
-        #print(actions)
-        trx = {"actions": actions}
-        try: 
-            resp = cleos.push_transaction(trx, KEY, broadcast=True)
-        except Exception as e:
-            logger.critical('Error creating accounts: {}'.format(e))
-            quit()
-
-        #logger.info(resp)
-        created_accounts += BATCH_SIZE
-        logger.info('Created {} accounts of {}'.format(created_accounts, num_accounts))
+    try:
+        create(original_params)
+    except Exception as e:
+        logger.critical('Error creating accounts: {}'.format(e))
+        exit(1)
 
     #Setting back chain params to original values
     logger.info('Setting back chain params to original values')
     global_params['max_block_cpu_usage'] = max_block_cpu_usage
     global_params['max_transaction_cpu_usage'] = max_transaction_cpu_usage
+    global_params['max_transaction_lifetime'] = max_transaction_lifetime
     try:     
         set_chain_params(global_params)
     except Exception as e:
         logger.critical('Error setting back chain params: {}'.format(e))
-        quit()
+        exit(1)
+
+def inject():
+    telos_genesis = load_inputs()
+    journal = open_journal(lambda journal: check_in_doubt(telos_genesis, journal))
+    logging.info('Creating accounts')
+
+    def create(global_params):
+        sizer = BatchSizer(BATCH_SIZE, MAX_BATCH_SIZE, CPU_LIMIT_US or global_params['max_block_cpu_usage'],
+                           global_params['max_transaction_net_usage'], CPU_SHARE)
+        create_accounts(telos_genesis, journal, sizer)
+
+    with_max_performance(journal, create)
+    logger.info('Injection finished')
+
+def spool():
+    telos_genesis = load_inputs()
+    logger.info('Signing accounts into spool {}'.format(SPOOL_OUT))
+    try:
+        count = write_spool(telos_genesis, SPOOL_OUT)
+    except Exception as e:
+        logger.critical('Error writing spool {}: {}'.format(SPOOL_OUT, e))
+        exit(1)
+    logger.info('Spool finished, {} transactions'.format(count))
+
+def replay():
+    try:
+        header = read_header(SPOOL_IN)
+        # A partial spool would push part of the genesis and still finish
+        count = verify_spool(SPOOL_IN)
+        logger.info('Spool {} has {} transactions for {} accounts'.format(SPOOL_IN, count, header['accounts']))
+        load_abis()
+        context = builder.chain_context()
+    except Exception as e:
+        logger.critical('Error opening spool {}: {}'.format(SPOOL_IN, e))
+        exit(1)
+    if header['chain_id'] != context['chain_id']:
+        logger.critical('Spool {} was signed for chain {}, not {}'.format(
+            SPOOL_IN, header['chain_id'], context['chain_id']))
+        exit(1)
+    # The TAPOS reference is checked against the summary slot of its low 16
+    # bits, overwritten 65536 blocks later. Offline spools reference block 0
+    ref_block = header.get('ref_block', 0)
+    if context['head_block_num'] >= ref_block + 0x10000:
+        logger.critical('Spool {} references block {}, replaced by block {} at head block {}'.format(
+            SPOOL_IN, ref_block, ref_block + 0x10000, context['head_block_num']))
+        exit(1)
+    # Against the chain clock, that is what nodeos checks expirations with
+    if not header.get('expires_at') or \
+            parse_block_time(header['expires_at']) <= time.time() + context['clock_offset']:
+        logger.critical('Spool {} has expired (expires_at {})'.format(SPOOL_IN, header.get('expires_at')))
+        exit(1)
+    # nodeos rejects expirations further than max_transaction_lifetime ahead
+    lifetime = parse_block_time(header['expires_at']) - int(time.time() + context['clock_offset'])
 
+    journal = open_journal(lambda journal: check_spool_in_doubt(SPOOL_IN, journal))
+    logger.info('Pushing spool {}'.format(SPOOL_IN))
+    with_max_performance(journal, lambda global_params: push_spool(SPOOL_IN, header, journal), lifetime)
     logger.info('Injection finished')
+
+def main():
+    global builder
+    signer = Signer(KEY, SIGN_WORKERS)
+    logger.debug('Signing with {}'.format(signer.backend))
+    get_info = offline_info if SPOOL_OUT and CHAIN_ID else lambda: post('get_info', {})
+    builder = TransactionBuilder(get_info, signer, EXPIRATION, TAPOS_REFRESH)
+    try:
+        if SPOOL_OUT:
+            spool()
+        elif SPOOL_IN:
+            replay()
+        else:
+            inject()
+    finally:
+        signer.close()
+
 if __name__ == "__main__":
-    main()
+    metrics.run(main, args)
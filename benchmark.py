@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+import logging
+import argparse
+import os
+import sys
+import colorlog
+import inspect
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import threading
+import zmq
+import numpy as np
+import zmq_fixture
+from mock_nodeos import MockNodeos, ABIS, CHAIN_ID
+from eosio_asset import UNIT, split_genesis, format_amounts
+from eosio_serializer import bytes_to_public_key
+from snapshot_format import SnapshotWriter
+
+SCRIPT_PATH = os.path.dirname(os.path.abspath(
+    inspect.getfile(inspect.currentframe())))
+TOOLS = ['injector', 'spool', 'validator', 'verifier', 'dumper']
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-v", '--verbose', action="store_true",
+                    dest="verbose", help='Print logged info to screen')
+parser.add_argument("-d", '--debug', action="store_true",
+                    dest="debug", help='Print debug info')
+parser.add_argument('-l', '--log_file', default='{}.log'.format(
+    os.path.basename(__file__).split('.')[0]), help='Log file')
+parser.add_argument('-t', '--tools', nargs='+', choices=TOOLS,
+                    default=TOOLS, help='Tools to benchmark')
+parser.add_argument('-n', '--accounts', type=int, nargs='+',
+                    default=[1000], help='Synthetic snapshot sizes')
+parser.add_argument('--contracts', type=int,
+                    default=100, help='Number of contracts for verify_contracts')
+parser.add_argument('--latency_ms', type=float,
+                    default=0, help='Latency the mock node adds to every request')
+parser.add_argument('--jitter_ms', type=float,
+                    default=0, help='Random extra latency up to this much')
+parser.add_argument('--error_rate', type=float,
+                    default=0, help='Share of requests the mock node fails with a 503')
+parser.add_argument('--replay_rate', type=float,
+                    default=0, help='Messages per second replayed to chain_dumper, 0 for full speed')
+parser.add_argument('--recording',
+                    help='ZMQ recording to replay to chain_dumper instead of a synthetic one')
+parser.add_argument('--seed', type=int,
+                    default=0, help='Seed of the synthetic data and the mock node')
+parser.add_argument('-o', '--output', default='benchmark-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')),
+                    help='JSON results file')
+parser.add_argument('-c', '--compare',
+                    help='Earlier results file to compare with')
+parser.add_argument('-w', '--work_dir',
+                    help='Directory for the snapshots and tool files, a temporary one is removed after the run')
+args = parser.parse_args()
+
+VERBOSE = args.verbose
+DEBUG = args.debug
+LOG_FILE = args.log_file
+BENCH_TOOLS = args.tools
+SIZES = args.accounts
+CONTRACTS = args.contracts
+LATENCY = args.latency_ms / 1000
+JITTER = args.jitter_ms / 1000
+ERROR_RATE = args.error_rate
+REPLAY_RATE = args.replay_rate
+RECORDING = args.recording
+SEED = args.seed
+OUTPUT = args.output
+COMPARE = args.compare
+WORK_DIR = args.work_dir
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = colorlog.ColoredFormatter(
+    '%(log_color)s%(asctime)s - %(levelname)s - %(message)s%(reset)s')
+if DEBUG:
+    logger.setLevel(logging.DEBUG)
+if VERBOSE:
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+fh = logging.FileHandler(LOG_FILE)
+fh.setFormatter(formatter)
+logger.addHandler(fh)
+
+NAME_LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+NUM_KEYS = 1000
+# validate_accounts input files: name, number of accounts taken from the
+# snapshot and the row layout with account, key and balance
+CATEGORY_FILES = [
+    ('initial_block_producers.csv', 21, 'a,b,{},{},{},d'),
+    ('eos_bp_accounts.csv', 21, 'a,{},{},{}'),
+    ('ram_accounts.csv', 100, '0x0,x,{},{},{}'),
+    ('tcrp_accounts.csv', 100, '{},{},{}'),
+    ('tfrp_accounts.csv', 100, '{},{},{}'),
+    ('tfvt_accounts.csv', 10, 'a,b,{},{},{}'),
+    ('telos_special_accounts.csv', 10, '0x0,{},{},{}'),
+]
+
+
+def account_name(i):
+    # bench followed by i in base 26, always a valid 12 character name
+    letters = []
+    for _ in range(7):
+        i, digit = divmod(i, 26)
+        letters.append(NAME_LETTERS[digit])
+    return 'bench' + ''.join(reversed(letters))
+
+
+def generate_snapshot(filename, count, rng):
+    # Synthetic genesis: distinct accounts sharing a pool of keys, balances
+    # from 0.1 to 100000 TLOS
+    keys = [bytes_to_public_key(b'\x00\x02' + rng.bytes(32)) for _ in range(NUM_KEYS)]
+    accounts = [account_name(i) for i in range(count)]
+    account_keys = [keys[i] for i in rng.integers(0, NUM_KEYS, count)]
+    balances = rng.integers(UNIT // 10, 100000 * UNIT, count)
+    eth = rng.bytes(20 * count)
+    with SnapshotWriter(filename) as writer:
+        for i in range(count):
+            writer.append(eth[20 * i:20 * (i + 1)].hex(), accounts[i], account_keys[i], int(balances[i]))
+    return accounts, account_keys, balances
+
+
+def category_files(accounts, keys, balances):
+    # Input files for validate_accounts in the layouts it reads
+    amounts = format_amounts(balances)
+    files = {}
+    pos = 0
+    for name, size, layout in CATEGORY_FILES:
+        lines = [layout.format(accounts[i % len(accounts)], keys[i % len(accounts)], amounts[i % len(accounts)])
+                 for i in range(pos, pos + size)]
+        pos += size
+        files[name] = ('header\n' + '\n'.join(lines) + '\n').encode()
+    files['key_recovery.csv'] = b''
+    return files
+
+
+def setup_injector(mock, work_dir, snapshot, url):
+    mock.accounts = {}
+    mock.scopes = mock.voters = None
+    return ['account_injector.py', '-s', snapshot, '-u', url,
+            '-j', os.path.join(work_dir, 'injector.journal')], None
+
+
+def setup_spool(mock, work_dir, snapshot, url):
+    # The spool is signed offline before the clock starts, only pushing it is timed
+    abi_dir = os.path.join(work_dir, 'abi')
+    os.makedirs(abi_dir, exist_ok=True)
+    for account, abi in ABIS.items():
+        with open(os.path.join(abi_dir, account + '.abi'), 'w') as fout:
+            json.dump(abi, fout)
+    spool = os.path.join(work_dir, 'accounts.spool')
+    expires_at = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(time.time() + 3600))
+    code, seconds, _ = run_tool(['account_injector.py', '-s', snapshot, '--spool_out', spool, '--chain_id', CHAIN_ID,
+                                 '--abi_dir', abi_dir, '--expires_at', expires_at], work_dir, 'spool-build')
+    if code != 0:
+        raise RuntimeError('Building the spool failed, see spool-build.log')
+    built = {'build_seconds': round(seconds, 3), 'spool_mb': round(os.path.getsize(spool) / 2 ** 20, 1)}
+    mock.accounts = {}
+    mock.scopes = mock.voters = None
+    return ['account_injector.py', '--spool_in', spool, '-u', url,
+            '-j', os.path.join(work_dir, 'spool.journal')], lambda: built
+
+
+def setup_validator(mock, work_dir, snapshot, url):
+    accounts, keys, balances = snapshot_data[snapshot]
+    liquid, cpu, net = split_genesis(balances)
+    mock.accounts = {}
+    mock.add_accounts(accounts, keys, liquid, cpu + net)
+    for name, data in category_files(accounts, keys, balances).items():
+        mock.add_file(name, data)
+    return ['validate_accounts.py', '-s', snapshot, '-u', url, '--inputs_url', url + '/files',
+            # The input files differ per snapshot, a shared cache would serve the last size's
+            '--cache_dir', os.path.join(work_dir, 'cache-{}'.format(len(accounts))),
+            '-o', os.path.join(work_dir, 'validator_diff.csv')], None
+
+
+def setup_verifier(mock, work_dir, snapshot, url):
+    rng = np.random.default_rng(SEED)
+    contracts_path = os.path.join(work_dir, 'contracts')
+    os.makedirs(contracts_path, exist_ok=True)
+    manifest = []
+    for i in range(CONTRACTS):
+        account = account_name(i)
+        wasm = os.path.join(contracts_path, account + '.wasm')
+        abi = os.path.join(contracts_path, account + '.abi')
+        data = rng.bytes(64 * 1024)
+        with open(wasm, 'wb') as fout:
+            fout.write(data)
+        with open(abi, 'w') as fout:
+            json.dump({'version': 'eosio::abi/1.1', 'structs': [], 'actions': []}, fout)
+        mock.add_contract(account, data, None)
+        manifest.append({'account': account, 'contract': account, 'wasm': wasm, 'abi': abi})
+    with open(os.path.join(work_dir, 'manifest.json'), 'w') as fout:
+        json.dump(manifest, fout)
+    return ['verify_contracts.py', '-u', url, '-m', os.path.join(work_dir, 'manifest.json'),
+            '--hash_cache', os.path.join(work_dir, 'verify_contracts.cache')], None
+
+
+def write_recording(filename, accounts, keys):
+    # Blocks of 100 accounts half a second apart, as the injector fills them
+    last_block = 0
+    with zmq_fixture.RecordingWriter(filename) as writer:
+        for block_num, message in zmq_fixture.genesis_messages(accounts, keys):
+            writer.write(message, timestamp=block_num * 0.5)
+            last_block = block_num
+    return last_block
+
+
+def recording_last_block(filename):
+    last_block = 0
+    for _, message in zmq_fixture.read_recording(filename):
+        msgtype, _ = zmq_fixture.MSG_HEADER.unpack_from(message)
+        if msgtype == zmq_fixture.MSGTYPE_IRREVERSIBLE_BLOCK:
+            last_block = max(last_block, json.loads(message[zmq_fixture.MSG_HEADER.size:])['irreversible_block_num'])
+    return last_block
+
+
+def setup_dumper(mock, work_dir, snapshot, url):
+    # The recording is replayed from a thread while chain_dumper runs, until
+    # its last irreversible block
+    if RECORDING:
+        recording = RECORDING
+        last_block = recording_last_block(recording)
+    else:
+        accounts, keys, _ = snapshot_data[snapshot]
+        recording = os.path.join(work_dir, 'recording.zmq')
+        last_block = write_recording(recording, accounts, keys)
+    context = zmq.Context()
+    socket = context.socket(zmq.PUSH)
+    socket.setsockopt(zmq.SNDHWM, 0)
+    socket.bind('tcp://127.0.0.1:*')
+    endpoint = socket.getsockopt_string(zmq.LAST_ENDPOINT)
+    stop = threading.Event()
+    replayed = {}
+
+    def send():
+        replayed['messages'], replayed['seconds'] = zmq_fixture.replay(
+            zmq_fixture.read_recording(recording), socket, rate=REPLAY_RATE, stop=stop.is_set)
+
+    thread = threading.Thread(target=send, daemon=True)
+    thread.start()
+    stats_file = os.path.join(work_dir, 'dumper-stats.json')
+
+    def finish():
+        stop.set()
+        thread.join()
+        socket.close(linger=0)
+        context.term()
+        with open(stats_file) as fin:
+            stats = json.load(fin)
+        stats['replay_messages_per_sec'] = round(replayed['messages'] / replayed['seconds'], 1) \
+            if replayed.get('seconds') else 0
+        return stats
+
+    return ['chain_dumper.py', '-z', endpoint, '-b', str(last_block), '--irreversible',
+            '-o', os.path.join(work_dir, 'chain_dump.txt'), '-i', os.path.join(work_dir, 'chain_index.db'),
+            '--stats_file', stats_file], finish
+
+
+SETUP = {'injector': setup_injector, 'spool': setup_spool, 'validator': setup_validator, 'verifier': setup_verifier,
+         'dumper': setup_dumper}
+snapshot_data = {}
+
+
+def run_tool(argv, work_dir, name):
+    # Returns the exit code, wall seconds and peak RSS in MB of the tool
+    log = os.path.join(work_dir, name + '.log')
+    with open(os.path.join(work_dir, name + '.out'), 'w') as out:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(SCRIPT_PATH, argv[0])] + argv[1:] + ['-l', log],
+                                   cwd=work_dir, stdout=out, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, seconds, usage.ru_maxrss / 1024
+
+
+def benchmark(mock, tool, size, work_dir, snapshot):
+    argv, finish = SETUP[tool](mock, work_dir, snapshot, mock.url)
+    count = CONTRACTS if tool == 'verifier' else size
+    mock.reset_stats()
+    try:
+        code, seconds, rss = run_tool(argv, work_dir, '{}-{}'.format(tool, size))
+    finally:
+        extra = finish() if finish else None
+    stats = mock.stats()
+    result = {
+        'tool': tool,
+        'accounts': count,
+        'exit_code': code,
+        'seconds': round(seconds, 3),
+        'accounts_per_sec': round(count / seconds, 1),
+        'rpcs': stats['rpcs'],
+        'rpcs_per_account': round(stats['rpcs'] / count, 3),
+        'errors': stats['errors'],
+        'latency_ms': stats['latency_ms'],
+        'peak_rss_mb': round(rss, 1),
+        'requests': stats['requests'],
+    }
+    log = logger.info if code == 0 else logger.error
+    if tool == 'spool':
+        result['spool'] = extra
+    if tool == 'dumper':
+        result['dumper'] = extra
+        log('{} {} accounts: {:.1f} accounts/s, {:.0f} messages/s, {} us decode/message, '
+            'queue backlog {} batches, {:.0f} MB, exit {}'.format(
+                tool, count, result['accounts_per_sec'], extra['messages_per_sec'],
+                extra['decode_us_per_message'], extra['max_queue'], rss, code))
+        return result
+    log('{} {} accounts: {:.1f} accounts/s, {:.2f} RPCs/account, p50 {} ms, p99 {} ms, {:.0f} MB, exit {}'.format(
+        tool, count, result['accounts_per_sec'], result['rpcs_per_account'], stats['latency_ms']['p50'],
+        stats['latency_ms']['p99'], rss, code))
+    return result
+
+
+def compare(results, filename):
+    with open(filename) as fin:
+        previous = {(r['tool'], r['accounts']): r for r in json.load(fin)['results']}
+    for result in results:
+        old = previous.get((result['tool'], result['accounts']))
+        if old is None or not old['accounts_per_sec']:
+            continue
+        change = result['accounts_per_sec'] / old['accounts_per_sec'] - 1
+        log = logger.warning if change < -0.1 else logger.info
+        log('{} {} accounts: {:.1f} accounts/s, {:+.1%} against {}'.format(
+            result['tool'], result['accounts'], result['accounts_per_sec'], change, filename))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    work_dir = WORK_DIR or tempfile.mkdtemp(prefix='benchmark-')
+    os.makedirs(work_dir, exist_ok=True)
+    mock = MockNodeos(latency=LATENCY, jitter=JITTER, error_rate=ERROR_RATE, seed=SEED)
+    mock.start()
+    logger.info('Mock node at {}, files in {}'.format(mock.url, work_dir))
+
+    results = []
+    try:
+        for size in SIZES:
+            snapshot = os.path.join(work_dir, 'snapshot-{}.bin'.format(size))
+            logger.info('Generating snapshot of {} accounts'.format(size))
+            snapshot_data[snapshot] = generate_snapshot(snapshot, size, np.random.default_rng(SEED))
+            for tool in BENCH_TOOLS:
+                results.append(benchmark(mock, tool, size, work_dir, snapshot))
+            del snapshot_data[snapshot]
+    finally:
+        mock.stop()
+        if not WORK_DIR:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'mock': {'latency_ms': LATENCY * 1000, 'jitter_ms': JITTER * 1000,
+                 'error_rate': ERROR_RATE, 'seed': SEED},
+        'results': results,
+    }
+    with open(OUTPUT, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    logger.info('Results written to {}'.format(OUTPUT))
+    if COMPARE:
+        compare(results, COMPARE)
+
+    if any(result['exit_code'] for result in results):
+        exit(1)
+if __name__ == "__main__":
+    main()
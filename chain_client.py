@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import json
+import asyncio
+import random
+import aiohttp
+import metrics
+
+
+RETRY_STATUS = [502, 503, 504]
+
+
+class ChainError(Exception):
+    pass
+
+
+class ChainClient:
+    # Pooled asyncio client for the nodeos chain API. Errors reported by nodeos
+    # are raised as ChainError with the response body, transport failures and
+    # gateway errors are retried with jittered backoff
+
+    def __init__(self, url, concurrency=64, timeout=30, retries=3, backoff=0.5):
+        self.url = url.rstrip('/')
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def post(self, path, payload):
+        url = '{}/v1/{}'.format(self.url, path)
+        method = path.split('/')[-1]
+        attempt = 0
+        while True:
+            # The slot is only held for the request itself, never while
+            # backing off, so failing calls don't starve the rest of the pool
+            async with self.semaphore:
+                try:
+                    with metrics.timer('rpc_seconds', method=method):
+                        async with self.session.post(url, json=payload) as resp:
+                            if resp.status not in RETRY_STATUS:
+                                return self._result(method, resp.status, await resp.text())
+                            error = 'HTTP {}'.format(resp.status)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+            if attempt >= self.retries:
+                metrics.inc('rpc_errors', method=method)
+                raise ChainError('Error calling {}: {}'.format(path, error))
+            attempt += 1
+            metrics.inc('rpc_retries', method=method)
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def _result(self, method, status, text):
+        try:
+            body = json.loads(text)
+        except ValueError:
+            metrics.inc('rpc_errors', method=method)
+            raise ChainError('Error: HTTP {} with a body that is not JSON: {!r}'.format(status, text[:200]))
+        if status != 200:
+            metrics.inc('rpc_errors', method=method)
+            raise ChainError('Error: {}'.format(body))
+        return body
+
+    async def get_info(self):
+        return await self.post('chain/get_info', {})
+
+    async def get_account(self, account):
+        return await self.post('chain/get_account', {'account_name': account})
+
+    async def get_code(self, account):
+        return await self.post('chain/get_code', {'account_name': account, 'code_as_wasm': True})
+
+    async def get_table_rows(self, code, scope, table, lower_bound='', limit=10):
+        return await self.post('chain/get_table_rows', {
+            'json': True, 'code': code, 'scope': scope, 'table': table,
+            'lower_bound': lower_bound, 'limit': limit})
+
+    async def get_table_by_scope(self, code, table, lower_bound='', limit=10):
+        return await self.post('chain/get_table_by_scope', {
+            'code': code, 'table': table, 'lower_bound': lower_bound, 'limit': limit})
+
+    async def get_accounts_by_authorizers(self, keys):
+        return await self.post('chain/get_accounts_by_authorizers', {'accounts': [], 'keys': keys})
+
+    async def get_raw_code_and_abi(self, account):
+        return await self.post('chain/get_raw_code_and_abi', {'account_name': account})
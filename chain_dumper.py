@@ -8,6 +8,20 @@ import inspect
 import zmq
 import json
 import pprint
+import struct
+import signal
+import gzip
+import time
+import queue
+import threading
+import metrics
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from chain_index import ChainIndex, INDEX_ACTIONS
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 SCRIPT_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
@@ -22,8 +36,35 @@ parser.add_argument('-l', '--log_file', default='{}.log'.format(
 parser.add_argument('-o', '--dump_file', default='{}/{}'.format(SCRIPT_PATH, 'chain_dump.txt'), help='Log file')
 parser.add_argument('-b', '--block_num', type=int, required=True,
                     help='Block number to stop the dump(included)')
+parser.add_argument('--start_block', type=int, default=1,
+                    help='First block number to dump')
+parser.add_argument('--irreversible', action='store_true',
+                    help='Stop once block_num is irreversible instead of on the first block past it')
+parser.add_argument('--resume', action='store_true',
+                    help='Continue after the last checkpointed block of a previous run')
 parser.add_argument('-z', '--zmq_socket',
                     default='tcp://127.0.0.1:5556', help='ZMQ socket where to listen')
+parser.add_argument('-i', '--index_file',
+                    help='SQLite file indexing account keys, stakes, RAM and balances')
+parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                    help='Processes decoding messages')
+parser.add_argument('--message_batch', type=int, default=1000,
+                    help='Messages handed to a worker at once')
+parser.add_argument('--queue_size', type=int, default=64,
+                    help='Received batches waiting for a worker')
+parser.add_argument('--zmq_hwm', type=int, default=100000,
+                    help='ZMQ receive high water mark, nodeos blocks once it is reached')
+parser.add_argument('--zmq_rcvbuf', type=int, default=0,
+                    help='Socket receive buffer size in bytes, 0 for the OS default')
+parser.add_argument('-c', '--compression', choices=['gzip', 'zstd'],
+                    help='Compress the dump file')
+parser.add_argument('--flush_size', type=int, default=1024 * 1024,
+                    help='Buffered bytes before writing to the dump file')
+parser.add_argument('--flush_interval', type=float, default=5,
+                    help='Seconds before buffered records are written to the dump file')
+parser.add_argument('--stats_file',
+                    help='JSON file with message rate, decode time and queue backlog written at the end')
+metrics.add_arguments(parser)
 args = parser.parse_args()
 
 VERBOSE = args.verbose
@@ -31,7 +72,20 @@ DEBUG = args.debug
 LOG_FILE = args.log_file
 DUMP_FILE = args.dump_file
 BLOCK_NUM = args.block_num
+START_BLOCK = args.start_block
+IRREVERSIBLE = args.irreversible
+RESUME = args.resume
 ZMQ_SOCKET = args.zmq_socket
+INDEX_FILE = args.index_file
+WORKERS = args.workers
+MESSAGE_BATCH = args.message_batch
+QUEUE_SIZE = args.queue_size
+ZMQ_HWM = args.zmq_hwm
+ZMQ_RCVBUF = args.zmq_rcvbuf
+COMPRESSION = args.compression
+FLUSH_SIZE = args.flush_size
+FLUSH_INTERVAL = args.flush_interval
+STATS_FILE = args.stats_file
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -52,40 +106,331 @@ SCRIPT_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
 pp = pprint.PrettyPrinter(indent=2)
 
+# zmq_plugin messages start with an int32 message type and int32 options
+MSGTYPE_ACTION_TRACE = 0
+MSGTYPE_IRREVERSIBLE_BLOCK = 1
+MSG_HEADER = struct.Struct('<ii')
+STATS_INTERVAL = 100000
+POLL_TIMEOUT_MS = 100
+
+
+class MessageFilter:
+    # Rejects messages from the type header and a byte scan, only candidates
+    # get a full JSON decode
+
+    def __init__(self, action_names):
+        self.patterns = [('"{}"'.format(name)).encode() for name in action_names]
+        self.received = 0
+        self.skipped_type = 0
+        self.skipped_scan = 0
+        self.parsed = 0
+
+    def decode(self, data):
+        self.received += 1
+        msgtype, _ = MSG_HEADER.unpack_from(data)
+        if msgtype != MSGTYPE_ACTION_TRACE:
+            self.skipped_type += 1
+            return None
+        if not any(data.find(pattern, MSG_HEADER.size) >= 0 for pattern in self.patterns):
+            self.skipped_scan += 1
+            return None
+        self.parsed += 1
+        return json.loads(data[MSG_HEADER.size:])
+
+    def counts(self):
+        return self.received, self.skipped_type, self.skipped_scan, self.parsed
+
+    def add(self, counts):
+        received, skipped_type, skipped_scan, parsed = counts
+        self.received += received
+        self.skipped_type += skipped_type
+        self.skipped_scan += skipped_scan
+        self.parsed += parsed
+
+    def stats(self):
+        return 'received {}, skipped {} by type and {} by scan, parsed {}'.format(
+            self.received, self.skipped_type, self.skipped_scan, self.parsed)
+
+
+class DumpWriter:
+    # Buffers the records of complete blocks and writes them once enough bytes
+    # are pending or enough time has passed. Every write is fsynced and followed
+    # by a checkpoint with the last block written and the file size, so a
+    # resumed dump cuts anything after it and carries on from the next block
+
+    def __init__(self, filename, compression=None, flush_size=1024 * 1024, flush_interval=5, resume=False):
+        self.checkpoint_file = filename + '.checkpoint'
+        self.compression = compression
+        self.block_num = 0
+        self.written = 0
+        offset = 0
+        if resume and os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as fin:
+                checkpoint = json.load(fin)
+            self.block_num, self.written, offset = checkpoint['block_num'], checkpoint['written'], checkpoint['offset']
+        if offset:
+            self.raw = open(filename, 'r+b')
+            self.raw.truncate(offset)
+            self.raw.seek(offset)
+        else:
+            self.raw = open(filename, 'wb')
+            if os.path.exists(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+        self.file = self._open_stream()
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.buffered = 0
+        self.complete = self.block_num
+        self.last_flush = time.monotonic()
+
+    def _open_stream(self):
+        # Compressed output is written as one gzip member or zstd frame per
+        # flush, so the file is readable up to every checkpoint
+        if self.compression == 'gzip':
+            return gzip.GzipFile(fileobj=self.raw, mode='wb')
+        if self.compression == 'zstd':
+            if zstandard is None:
+                raise RuntimeError('zstd compression needs the zstandard package')
+            return zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        return self.raw
+
+    def write(self, record):
+        line = '{}\n'.format(record).encode()
+        self.buffer.append(line)
+        self.buffered += len(line)
+
+    def complete_block(self, block_num):
+        self.complete = max(self.complete, block_num)
+        if self.buffered >= self.flush_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self, reopen=True):
+        self.last_flush = time.monotonic()
+        if self.complete == self.block_num:
+            return
+        if self.buffer:
+            self.file.write(b''.join(self.buffer))
+            self.written += len(self.buffer)
+            self.buffer = []
+            self.buffered = 0
+        if self.file is not self.raw:
+            self.file.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.block_num = self.complete
+        with open(self.checkpoint_file + '.tmp', 'w') as fout:
+            json.dump({'block_num': self.block_num, 'written': self.written, 'offset': self.raw.tell()}, fout)
+        os.replace(self.checkpoint_file + '.tmp', self.checkpoint_file)
+        if self.file is not self.raw and reopen:
+            self.file = self._open_stream()
+
+    def close(self):
+        if self.raw.closed:
+            return
+        self.flush(reopen=False)
+        if self.file is not self.raw and not self.file.closed:
+            self.file.close()
+        self.raw.close()
+
+
+def iter_traces(trace):
+    yield trace
+    for inline in trace.get('inline_traces', []):
+        yield from iter_traces(inline)
+
+
+def decode_batch(messages, actions, irreversible=False):
+    # Runs in a worker process, returns (block_num, code, action, data, actor)
+    # for the matching actions of a batch of messages, in the order they were
+    # received, the last irreversible block seen, the filter counts and the
+    # seconds spent. Notifications are skipped so every action counts once
+    start = time.perf_counter()
+    message_filter = MessageFilter(set(action for _, action in actions))
+    records = []
+    irreversible_block = 0
+    for data in messages:
+        if irreversible and MSG_HEADER.unpack_from(data)[0] == MSGTYPE_IRREVERSIBLE_BLOCK:
+            block = json.loads(data[MSG_HEADER.size:])
+            irreversible_block = max(irreversible_block, block['irreversible_block_num'])
+        action = message_filter.decode(data)
+        if action is None or 'action_trace' not in action:
+            continue
+        block_num = action['action_trace']['block_num']
+        for trace in iter_traces(action['action_trace']):
+            act = trace['act']
+            if (act['account'], act['name']) not in actions:
+                continue
+            receiver = trace['receipt']['receiver'] if 'receipt' in trace else trace.get('receiver', act['account'])
+            if receiver != act['account']:
+                continue
+            actor = act['authorization'][0]['actor'] if act.get('authorization') else ''
+            records.append((block_num, act['account'], act['name'], act['data'], actor))
+    return records, irreversible_block, message_filter.counts(), time.perf_counter() - start
+
+
+def receive(socket, batches, stop):
+    # Only drains the socket so nodeos is never held up by decoding, a
+    # partial batch is queued as soon as the socket goes quiet
+    batch = []
+    while not stop.is_set():
+        if socket.poll(POLL_TIMEOUT_MS):
+            batch.append(socket.recv())
+            if len(batch) < MESSAGE_BATCH:
+                continue
+        if batch:
+            metrics.inc('zmq_messages', len(batch))
+            metrics.inc('zmq_bytes', sum(len(data) for data in batch))
+            # Time blocked here is time nodeos may be held up
+            with metrics.timer('queue_wait_seconds'):
+                batches.put(batch)
+            batch = []
+
+
+def ignore_signals():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def handle_signal(signum, frame):
+    # Further signals would interrupt the final flush
+    ignore_signals()
+    raise SystemExit('Interrupted by signal {}'.format(signum))
+
+
 def main():
     context = zmq.Context()
     consumer_receiver = context.socket(zmq.PULL)
+    consumer_receiver.setsockopt(zmq.RCVHWM, ZMQ_HWM)
+    if ZMQ_RCVBUF:
+      consumer_receiver.setsockopt(zmq.RCVBUF, ZMQ_RCVBUF)
     consumer_receiver.connect(ZMQ_SOCKET)
-    
 
-    if os.path.exists(DUMP_FILE):
-      os.remove(DUMP_FILE)
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
 
     logger.info('Getting accounts from chain')
     logger.info('Saving accounts to {}'.format(DUMP_FILE))
-    file = open(DUMP_FILE, "a+")
-    while True:
-        data = consumer_receiver.recv()
-        action =  json.loads(data[8:])
-        code = data[0:8]
+    writer = DumpWriter(DUMP_FILE, COMPRESSION, FLUSH_SIZE, FLUSH_INTERVAL, resume=RESUME)
+    actions = {('eosio', 'newaccount')}
+    index = None
+    if INDEX_FILE:
+      logger.info('Indexing accounts to {}'.format(INDEX_FILE))
+      actions.update(INDEX_ACTIONS)
+      index = ChainIndex(INDEX_FILE, resume=RESUME)
+    if RESUME:
+      logger.info('Resuming dump after block {}'.format(writer.block_num))
+      if index:
+        logger.info('Resuming index after block {}'.format(index.block_num))
+    message_filter = MessageFilter(['newaccount'])
+    stop = threading.Event()
+    batches = queue.Queue(maxsize=QUEUE_SIZE)
+    receiver = threading.Thread(target=receive, args=(consumer_receiver, batches, stop), daemon=True)
+    executor = ProcessPoolExecutor(max_workers=WORKERS, initializer=ignore_signals)
+
+    # Records are held until their block is complete, so the dump and the
+    # index only ever checkpoint whole blocks
+    current_block = 0
+    block_records = []
+
+    def complete_block():
+      if current_block < START_BLOCK:
+        return
+      for block_num, code, action, data, actor in block_records:
+        if action == 'newaccount' and block_num > writer.block_num:
+          writer.write(data['name'])
+        if index and block_num > index.block_num:
+          index.apply(block_num, code, action, data, actor)
+      writer.complete_block(current_block)
+      if index:
+        index.complete_block(current_block)
+      metrics.gauge('block_num', current_block)
+      metrics.gauge('accounts_written', writer.written)
+
+    # Batches are settled in the order they were received, so accounts are
+    # written in block order whichever worker finishes first
+    pending = deque()
+    stats = {'decode_seconds': 0.0, 'max_queue': 0, 'max_pending': 0}
+    started = None
+    try:
+      receiver.start()
+      finished = False
+      while not finished:
+        stats['max_queue'] = max(stats['max_queue'], batches.qsize())
+        stats['max_pending'] = max(stats['max_pending'], len(pending))
+        metrics.gauge('queued_batches', batches.qsize())
+        metrics.gauge('pending_batches', len(pending))
+        if len(pending) >= 2 * WORKERS or (pending and pending[0].done()):
+          try:
+            records, irreversible_block, counts, seconds = pending.popleft().result()
+          except Exception as e:
+            logger.critical('Error dumping accounts')
+            logger.critical(e)
+            break
+          reported = message_filter.received // STATS_INTERVAL
+          message_filter.add(counts)
+          stats['decode_seconds'] += seconds
+          metrics.observe('decode_batch_seconds', seconds)
+          if message_filter.received // STATS_INTERVAL > reported:
+            logger.debug('Messages {}'.format(message_filter.stats()))
+          for record in records:
+            block_num = record[0]
+            if block_num > BLOCK_NUM:
+              if IRREVERSIBLE:
+                continue
+              finished = True
+              break
+            if block_num != current_block:
+              complete_block()
+              current_block, block_records = block_num, []
+            block_records.append(record)
+          if IRREVERSIBLE and irreversible_block >= BLOCK_NUM:
+            finished = True
+          if finished:
+            complete_block()
+            # Nothing else can show up below the stop block
+            current_block, block_records = BLOCK_NUM, []
+            complete_block()
+            logger.info('Messages {}'.format(message_filter.stats()))
+            logger.info('Dump finished')
+          continue
         try:
-          if 'action_trace' in action:
-            if action['action_trace']['act']['name'] == 'newaccount':
-              block_num = action['action_trace']['block_num']
-              if block_num > BLOCK_NUM:
-                logger.info('Dump finished')
-                quit()
-              else:
-                file.write('{}\n'.format(action['action_trace']['act']['data']['name']))
-                file.flush()
-
-        except Exception as e:
-          logger.critical('Error dumping accounts')
-          logger.critical(action)
-          logger.critical(e)
-          quit()
+          pending.append(executor.submit(decode_batch, batches.get(timeout=POLL_TIMEOUT_MS / 1000),
+                                         actions, IRREVERSIBLE))
+          started = started or time.perf_counter()
+        except queue.Empty:
+          pass
+    except SystemExit as e:
+      logger.warning(e)
+    finally:
+      stop.set()
+      executor.shutdown(wait=False, cancel_futures=True)
+      writer.close()
+      logger.info('{} accounts saved to {} up to block {}'.format(writer.written, DUMP_FILE, writer.block_num))
+      if index:
+        index.close()
+        logger.info('{} actions indexed, {} skipped, up to block {}'.format(index.applied, index.skipped, index.block_num))
+      if STATS_FILE:
+        write_stats(message_filter, writer, stats, time.perf_counter() - started if started else 0)
 
 
-if __name__ == "__main__":
-    main()
+def write_stats(message_filter, writer, stats, seconds):
+    received, skipped_type, skipped_scan, parsed = message_filter.counts()
+    with open(STATS_FILE, 'w') as fout:
+      json.dump({
+        'messages': received,
+        'skipped_type': skipped_type,
+        'skipped_scan': skipped_scan,
+        'parsed': parsed,
+        'accounts': writer.written,
+        'block_num': writer.block_num,
+        'seconds': round(seconds, 3),
+        'messages_per_sec': round(received / seconds, 1) if seconds else 0,
+        'decode_us_per_message': round(stats['decode_seconds'] * 1e6 / received, 3) if received else 0,
+        'max_queue': stats['max_queue'],
+        'max_pending': stats['max_pending'],
+      }, fout, indent=2)
 
+
+if __name__ == "__main__":
+    metrics.run(main, args)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+from eosio_asset import to_units, SYMBOL
+
+
+# (code, action) pairs that change the account state kept in the index
+INDEX_ACTIONS = [
+    ('eosio', 'newaccount'),
+    ('eosio', 'updateauth'),
+    ('eosio', 'delegatebw'),
+    ('eosio', 'buyrambytes'),
+    ('eosio.token', 'transfer'),
+    ('eosio.token', 'issue'),
+]
+BATCH_SIZE = 10000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS accounts (
+    account TEXT PRIMARY KEY,
+    creator TEXT,
+    block_num INTEGER
+);
+CREATE TABLE IF NOT EXISTS permissions (
+    account TEXT,
+    permission TEXT,
+    keys TEXT,
+    accounts INTEGER,
+    PRIMARY KEY (account, permission)
+);
+CREATE TABLE IF NOT EXISTS stakes (
+    account TEXT PRIMARY KEY,
+    cpu INTEGER,
+    net INTEGER
+);
+CREATE TABLE IF NOT EXISTS ram (
+    account TEXT PRIMARY KEY,
+    bytes INTEGER
+);
+CREATE TABLE IF NOT EXISTS balances (
+    account TEXT,
+    symbol TEXT,
+    units INTEGER,
+    PRIMARY KEY (account, symbol)
+);
+CREATE TABLE IF NOT EXISTS checkpoint (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    block_num INTEGER
+);
+'''
+
+
+def asset_symbol(quantity):
+    return quantity.strip().split(' ')[-1]
+
+
+class ChainIndex:
+    # Account state rebuilt from action traces. Changes are accumulated in
+    # memory, stakes, RAM and balances as deltas, and written in one
+    # transaction once batch_size actions are pending at the end of a block.
+    # The same transaction records the block as the checkpoint, so a resumed
+    # index never applies an action twice
+
+    def __init__(self, filename, batch_size=BATCH_SIZE, resume=False):
+        if not resume and os.path.exists(filename):
+            os.remove(filename)
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+        row = self.db.execute('SELECT block_num FROM checkpoint').fetchone()
+        self.block_num = row[0] if row else 0
+        self.complete = self.block_num
+        self.batch_size = batch_size
+        self.applied = 0
+        self.skipped = 0
+        self._reset()
+
+    def _reset(self):
+        self.pending = 0
+        self.accounts = {}
+        self.permissions = {}
+        self.stakes = {}
+        self.ram = {}
+        self.balances = {}
+
+    def _credit(self, account, quantity):
+        key = (account, asset_symbol(quantity))
+        self.balances[key] = self.balances.get(key, 0) + to_units(quantity)
+
+    def _stake(self, account, cpu, net):
+        old_cpu, old_net = self.stakes.get(account, (0, 0))
+        self.stakes[account] = (old_cpu + cpu, old_net + net)
+
+    def _permission(self, account, permission, auth):
+        keys = ','.join(k['key'] for k in auth.get('keys', []))
+        self.permissions[(account, permission)] = (keys, len(auth.get('accounts', [])))
+
+    def apply(self, block_num, code, action, data, actor):
+        # Actions without an ABI to decode them arrive as hex
+        if not isinstance(data, dict):
+            self.skipped += 1
+            return
+        if (code, action) == ('eosio', 'newaccount'):
+            self.accounts[data['name']] = (data['creator'], block_num)
+            self._permission(data['name'], 'owner', data['owner'])
+            self._permission(data['name'], 'active', data['active'])
+        elif (code, action) == ('eosio', 'updateauth'):
+            self._permission(data['account'], data['permission'], data['auth'])
+        elif (code, action) == ('eosio', 'delegatebw'):
+            self._stake(data['receiver'], to_units(data['stake_cpu_quantity']),
+                        to_units(data['stake_net_quantity']))
+        elif (code, action) == ('eosio', 'buyrambytes'):
+            self.ram[data['receiver']] = self.ram.get(data['receiver'], 0) + int(data['bytes'])
+        elif (code, action) == ('eosio.token', 'transfer'):
+            self._credit(data['from'], '-' + data['quantity'].strip())
+            self._credit(data['to'], data['quantity'])
+        elif (code, action) == ('eosio.token', 'issue'):
+            # Issued tokens go to the issuer, reaching 'to' as an inline transfer
+            self._credit(actor, data['quantity'])
+        else:
+            self.skipped += 1
+            return
+        self.applied += 1
+        self.pending += 1
+
+    def complete_block(self, block_num):
+        self.complete = max(self.complete, block_num)
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.complete == self.block_num:
+            return
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO accounts VALUES (?, ?, ?)',
+                [(account, creator, block_num) for account, (creator, block_num) in self.accounts.items()])
+            self.db.executemany(
+                'INSERT OR REPLACE INTO permissions VALUES (?, ?, ?, ?)',
+                [(account, permission, keys, accounts)
+                 for (account, permission), (keys, accounts) in self.permissions.items()])
+            self.db.executemany(
+                'INSERT INTO stakes VALUES (?, ?, ?) ON CONFLICT(account) '
+                'DO UPDATE SET cpu = cpu + excluded.cpu, net = net + excluded.net',
+                [(account, cpu, net) for account, (cpu, net) in self.stakes.items()])
+            self.db.executemany(
+                'INSERT INTO ram VALUES (?, ?) ON CONFLICT(account) '
+                'DO UPDATE SET bytes = bytes + excluded.bytes',
+                list(self.ram.items()))
+            self.db.executemany(
+                'INSERT INTO balances VALUES (?, ?, ?) ON CONFLICT(account, symbol) '
+                'DO UPDATE SET units = units + excluded.units',
+                [(account, symbol, units) for (account, symbol), units in self.balances.items()])
+            self.db.execute('INSERT OR REPLACE INTO checkpoint VALUES (0, ?)', (self.complete,))
+        self.block_num = self.complete
+        self._reset()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def list_accounts(filename):
+    db = sqlite3.connect(filename)
+    try:
+        return [account for account, in db.execute('SELECT account FROM accounts ORDER BY account')]
+    finally:
+        db.close()
+
+
+def load_account_index(filename, accounts, symbol=SYMBOL):
+    # account -> (key, liquid, staked) in 1/10000 units, the same shape
+    # validate_accounts builds from the chain API. The key is only set when
+    # owner and active hold the same single key and no account authorities,
+    # it is None for accounts that were never created
+    db = sqlite3.connect(filename)
+    try:
+        keys = {}
+        for account, permission, key, auth_accounts in db.execute(
+                'SELECT account, permission, keys, accounts FROM permissions'):
+            keys.setdefault(account, {})[permission] = (key, auth_accounts)
+        stakes = {account: cpu + net for account, cpu, net in db.execute('SELECT account, cpu, net FROM stakes')}
+        liquid = dict(db.execute('SELECT account, units FROM balances WHERE symbol = ?', (symbol,)))
+        created = set(account for account, in db.execute('SELECT account FROM accounts'))
+    finally:
+        db.close()
+
+    index = {}
+    for account in accounts:
+        if account not in created:
+            index[account] = (None, 0, 0)
+            continue
+        perms = keys.get(account, {})
+        owner, active = perms.get('owner'), perms.get('active')
+        key = ''
+        if set(perms) == {'owner', 'active'} and owner == active and owner[1] == 0 and ',' not in owner[0]:
+            key = owner[0]
+        index[account] = (key, liquid.get(account, 0), stakes.get(account, 0))
+    return index
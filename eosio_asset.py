@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+PRECISION = 4
+UNIT = 10 ** PRECISION
+SYMBOL = 'TLOS'
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def to_units(value):
+    # '12.3400', '12.34 TLOS' or '12' to an exact int64 amount of 1/10000 units
+    amount = str(value).strip().split(' ')[0]
+    negative = amount.startswith('-')
+    integer, _, fraction = amount.lstrip('-').partition('.')
+    if len(fraction) > PRECISION:
+        raise ValueError('Too many decimals in {!r}'.format(value))
+    units = int(integer or '0') * UNIT + int(fraction.ljust(PRECISION, '0'))
+    return -units if negative else units
+
+
+def format_units(units):
+    sign = '-' if units < 0 else ''
+    units = abs(int(units))
+    return '{}{}.{:0{}d}'.format(sign, units // UNIT, units % UNIT, PRECISION)
+
+
+def format_asset(units, symbol=SYMBOL):
+    return '{} {}'.format(format_units(units), symbol)
+
+
+def parse_amounts(values):
+    # Vectorized to_units. Strings are viewed as a byte matrix and parsed one
+    # character column at a time, which is much faster than casting strings.
+    # An amount is an optional sign, digits with at most one dot and
+    # PRECISION decimals, then optionally a space and the symbol, anything
+    # else raises like to_units does
+    data = np.asarray(values, dtype=bytes)
+    units = np.zeros(len(data), dtype=np.int64)
+    if data.size == 0:
+        return units
+    if data.itemsize == 0:
+        raise ValueError('Invalid amount {!r}'.format(''))
+    chars = np.ascontiguousarray(data).view(np.uint8).reshape(len(data), data.itemsize)
+    decimals = np.full(len(data), -1, dtype=np.int64)
+    digits = np.zeros(len(data), dtype=np.int64)
+    negative = np.zeros(len(data), dtype=bool)
+    started = np.zeros(len(data), dtype=bool)
+    done = np.zeros(len(data), dtype=bool)
+    invalid = np.zeros(len(data), dtype=bool)
+    for column in chars.T:
+        digit = (column >= 48) & (column <= 57) & ~done
+        dot = (column == 46) & ~done
+        minus = (column == 45) & ~done
+        space = ((column == 32) | (column == 9)) & ~done
+        # Shorter strings are padded with zero bytes
+        end = (column == 0) & ~done
+        invalid |= ~done & ~(digit | dot | minus | space | end)
+        invalid |= (dot & (decimals >= 0)) | (minus & (started | negative)) | (space & negative & ~started)
+        # Checked before each digit, int64 would wrap around silently
+        value = column.astype(np.int64) - 48
+        invalid |= digit & (units > (INT64_MAX - value) // 10)
+        units = np.where(digit & ~invalid, units * 10 + value, units)
+        digits += digit
+        decimals = np.where(digit & (decimals >= 0), decimals + 1, decimals)
+        decimals = np.where(dot, 0, decimals)
+        negative |= minus
+        started |= digit | dot
+        # A space after the amount starts the symbol
+        done |= (started & space) | end
+    # The missing decimals still have to be scaled in without overflowing
+    scale = 10 ** (PRECISION - np.clip(decimals, 0, PRECISION))
+    invalid |= (digits == 0) | (decimals > PRECISION) | (units > INT64_MAX // scale)
+    if invalid.any():
+        raise ValueError('Invalid amount {!r}'.format(data[int(np.argmax(invalid))].decode(errors='replace')))
+    units *= scale
+    return np.where(negative, -units, units)
+
+
+def format_amounts(units):
+    # Vectorized format_units
+    units = np.asarray(units, dtype=np.int64)
+    if units.size == 0:
+        return np.zeros(0, dtype=str)
+    negative = units < 0
+    units = np.abs(units)
+    integer = (units // UNIT).astype('S19')
+    # UNIT + fraction keeps the leading zeros, its leading 1 becomes the dot
+    fraction = np.ascontiguousarray((units % UNIT + UNIT).astype('S{}'.format(PRECISION + 1)))
+    fraction.view(np.uint8).reshape(len(units), PRECISION + 1)[:, 0] = ord('.')
+    amounts = np.char.add(np.where(negative, b'-', b''), np.char.add(integer, fraction))
+    return amounts.astype(str)
+
+
+def total(units):
+    return int(np.asarray(units, dtype=np.int64).sum())
+
+
+def cap(units, limit):
+    return np.minimum(np.asarray(units, dtype=np.int64), limit)
+
+
+def split_genesis(units):
+    # Liquid, cpu and net stake of each genesis balance. The odd unit of an
+    # uneven remainder goes to cpu
+    units = np.asarray(units, dtype=np.int64)
+    liquid = np.select([units < 3 * UNIT, units <= 11 * UNIT],
+                       [UNIT // 10, 2 * UNIT], 10 * UNIT).astype(np.int64)
+    remainder = units - liquid
+    cpu = remainder - remainder // 2
+    net = remainder - cpu
+    return liquid, cpu, net
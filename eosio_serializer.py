@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+
+import struct
+import hashlib
+import binascii
+import json
+
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_INDEX = {c: i for i, c in enumerate(BASE58_ALPHABET)}
+NAME_CHARS = '.12345abcdefghijklmnopqrstuvwxyz'
+KEY_TYPES = {'K1': 0, 'R1': 1}
+
+
+class SerializationError(Exception):
+    pass
+
+
+def base58_decode(s):
+    value = 0
+    for c in s:
+        if c not in BASE58_INDEX:
+            raise SerializationError('Invalid base58 character {!r}'.format(c))
+        value = value * 58 + BASE58_INDEX[c]
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    leading = len(s) - len(s.lstrip('1'))
+    return b'\x00' * leading + data
+
+
+def base58_encode(data):
+    value = int.from_bytes(data, 'big')
+    chars = []
+    while value:
+        value, mod = divmod(value, 58)
+        chars.append(BASE58_ALPHABET[mod])
+    leading = len(data) - len(data.lstrip(b'\x00'))
+    return '1' * leading + ''.join(reversed(chars))
+
+
+def ripemd160(data):
+    return hashlib.new('ripemd160', data).digest()
+
+
+def string_to_name(s):
+    if len(s) > 13:
+        raise SerializationError('Name {!r} is longer than 13 characters'.format(s))
+    value = 0
+    for i in range(13):
+        c = 0
+        if i < len(s):
+            c = NAME_CHARS.find(s[i])
+            if c < 0:
+                raise SerializationError('Invalid character in name {!r}'.format(s))
+        if i < 12:
+            value |= (c & 0x1f) << (64 - 5 * (i + 1))
+        else:
+            if c > 0x0f:
+                raise SerializationError('Invalid 13th character in name {!r}'.format(s))
+            value |= c
+    return value
+
+
+def name_to_string(value):
+    chars = []
+    for i in range(13):
+        if i == 0:
+            c = value & 0x0f
+            value >>= 4
+        else:
+            c = value & 0x1f
+            value >>= 5
+        chars.append(NAME_CHARS[c])
+    return ''.join(reversed(chars)).rstrip('.')
+
+
+def public_key_to_bytes(key):
+    # Returns the key type followed by the 33 byte compressed point
+    if key.startswith('PUB_'):
+        key_type, _, encoded = key[4:].partition('_')
+        if key_type not in KEY_TYPES:
+            raise SerializationError('Unsupported key type {}'.format(key_type))
+        suffix = key_type.encode()
+    elif key.startswith('EOS'):
+        key_type, encoded, suffix = 'K1', key[3:], b''
+    else:
+        raise SerializationError('Unrecognized public key format {!r}'.format(key))
+
+    raw = base58_decode(encoded)
+    if len(raw) != 37:
+        raise SerializationError('Invalid public key length {!r}'.format(key))
+    data, checksum = raw[:33], raw[33:]
+    if ripemd160(data + suffix)[:4] != checksum:
+        raise SerializationError('Invalid public key checksum {!r}'.format(key))
+    return bytes([KEY_TYPES[key_type]]) + data
+
+
+def bytes_to_public_key(data):
+    # Legacy EOS prefix, the same format get_account returns for K1 keys
+    if data[0] == 0:
+        return 'EOS' + base58_encode(data[1:] + ripemd160(data[1:])[:4])
+    return 'PUB_R1_' + base58_encode(data[1:] + ripemd160(data[1:] + b'R1')[:4])
+
+
+def symbol_to_int(precision, code):
+    if len(code) > 7 or not code.isupper():
+        raise SerializationError('Invalid symbol code {!r}'.format(code))
+    value = 0
+    for i, c in enumerate(code):
+        value |= ord(c) << (8 * (i + 1))
+    return value | int(precision)
+
+
+def parse_asset(s):
+    amount, code = s.strip().split(' ')
+    negative = amount.startswith('-')
+    if negative:
+        amount = amount[1:]
+    integer, _, fraction = amount.partition('.')
+    units = int(integer + fraction)
+    return (-units if negative else units), len(fraction), code
+
+
+def varuint32(value):
+    out = bytearray()
+    value = int(value)
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def varint32(value):
+    value = int(value)
+    return varuint32(((value << 1) ^ (value >> 31)) & 0xffffffff)
+
+
+def _pack(fmt):
+    packer = struct.Struct('<' + fmt).pack
+    return lambda value: packer(int(value))
+
+
+def _encode_bool(value):
+    if isinstance(value, str):
+        value = value.lower() == 'true'
+    return b'\x01' if value else b'\x00'
+
+
+def _encode_string(value):
+    data = value.encode('utf-8')
+    return varuint32(len(data)) + data
+
+
+def _encode_bytes(value):
+    data = binascii.unhexlify(value)
+    return varuint32(len(data)) + data
+
+
+def _encode_name(value):
+    # Names already encoded as integers pass through
+    if isinstance(value, int):
+        return struct.pack('<Q', value)
+    return struct.pack('<Q', string_to_name(value))
+
+
+def _encode_symbol(value):
+    precision, code = value.split(',')
+    return struct.pack('<Q', symbol_to_int(precision, code))
+
+
+def _encode_symbol_code(value):
+    return struct.pack('<Q', symbol_to_int(0, value) >> 8)
+
+
+def _encode_asset(value):
+    amount, precision, code = parse_asset(value)
+    return struct.pack('<qQ', amount, symbol_to_int(precision, code))
+
+
+def _encode_extended_asset(value):
+    return _encode_asset(value['quantity']) + _encode_name(value['contract'])
+
+
+def _encode_public_key(value):
+    # So are keys already in their binary form
+    if isinstance(value, bytes):
+        return value
+    return public_key_to_bytes(value)
+
+
+def _encode_checksum(size):
+    def encode(value):
+        data = binascii.unhexlify(value)
+        if len(data) != size:
+            raise SerializationError('Invalid checksum length {!r}'.format(value))
+        return data
+    return encode
+
+
+BUILTIN_ENCODERS = {
+    'bool': _encode_bool,
+    'int8': _pack('b'),
+    'uint8': _pack('B'),
+    'int16': _pack('h'),
+    'uint16': _pack('H'),
+    'int32': _pack('i'),
+    'uint32': _pack('I'),
+    'int64': _pack('q'),
+    'uint64': _pack('Q'),
+    'float32': lambda value: struct.pack('<f', float(value)),
+    'float64': lambda value: struct.pack('<d', float(value)),
+    'varuint32': varuint32,
+    'varint32': varint32,
+    'string': _encode_string,
+    'bytes': _encode_bytes,
+    'name': _encode_name,
+    'symbol': _encode_symbol,
+    'symbol_code': _encode_symbol_code,
+    'asset': _encode_asset,
+    'extended_asset': _encode_extended_asset,
+    'public_key': _encode_public_key,
+    'checksum160': _encode_checksum(20),
+    'checksum256': _encode_checksum(32),
+    'checksum512': _encode_checksum(64),
+}
+
+
+class AbiSerializer:
+    # Compiles the structs of a contract ABI into encoders so action data
+    # can be packed locally with the same output as abi_json_to_bin
+
+    def __init__(self, abi):
+        self.aliases = {t['new_type_name']: t['type'] for t in abi.get('types', [])}
+        self.structs = {s['name']: s for s in abi.get('structs', [])}
+        self.actions = {a['name']: a['type'] for a in abi.get('actions', [])}
+        self.encoders = {}
+
+    def resolve(self, type_name):
+        seen = set()
+        while type_name in self.aliases:
+            if type_name in seen:
+                raise SerializationError('Circular type alias {}'.format(type_name))
+            seen.add(type_name)
+            type_name = self.aliases[type_name]
+        return type_name
+
+    def get_encoder(self, type_name):
+        if type_name not in self.encoders:
+            self.encoders[type_name] = self._compile(type_name)
+        return self.encoders[type_name]
+
+    def _compile(self, type_name):
+        if type_name.endswith('[]'):
+            item = self.get_encoder(type_name[:-2])
+            return lambda value: varuint32(len(value)) + b''.join(item(v) for v in value)
+        if type_name.endswith('?'):
+            item = self.get_encoder(type_name[:-1])
+            return lambda value: b'\x00' if value is None else b'\x01' + item(value)
+        if type_name.endswith('$'):
+            return self.get_encoder(type_name[:-1])
+
+        resolved = self.resolve(type_name)
+        if resolved != type_name:
+            return self.get_encoder(resolved)
+        if type_name in BUILTIN_ENCODERS:
+            return BUILTIN_ENCODERS[type_name]
+        if type_name not in self.structs:
+            raise SerializationError('Unknown ABI type {}'.format(type_name))
+
+        struct_def = self.structs[type_name]
+        base = self.get_encoder(struct_def['base']) if struct_def.get('base') else None
+        # Field encoders are looked up lazily so recursive structs compile
+        fields = [(f['name'], f['type']) for f in struct_def['fields']]
+
+        def encode(value):
+            out = [base(value)] if base else []
+            for field_name, field_type in fields:
+                if field_name not in value:
+                    if field_type.endswith('$'):
+                        break
+                    raise SerializationError('Missing field {} in {}'.format(field_name, type_name))
+                out.append(self.get_encoder(field_type)(value[field_name]))
+            return b''.join(out)
+        return encode
+
+    def encode_action(self, action, data):
+        if action not in self.actions:
+            raise SerializationError('Unknown action {}'.format(action))
+        return binascii.hexlify(self.get_encoder(self.actions[action])(data)).decode()
+
+
+def _encode_action(action):
+    # Action data is hex, the way encode_action returns it
+    return (_encode_name(action['account']) + _encode_name(action['name']) +
+            varuint32(len(action['authorization'])) +
+            b''.join(_encode_name(level['actor']) + _encode_name(level['permission'])
+                     for level in action['authorization']) +
+            _encode_bytes(action['data']))
+
+
+def encode_transaction(trx):
+    # Packed transaction with expiration in seconds since the epoch, no
+    # context free actions and no extensions
+    return (struct.pack('<IHI', trx['expiration'], trx['ref_block_num'] & 0xffff, trx['ref_block_prefix']) +
+            varuint32(trx.get('max_net_usage_words', 0)) + struct.pack('<B', trx.get('max_cpu_usage_ms', 0)) +
+            varuint32(trx.get('delay_sec', 0)) + varuint32(0) +
+            varuint32(len(trx['actions'])) + b''.join(_encode_action(action) for action in trx['actions']) +
+            varuint32(0))
+
+
+class BinaryReader:
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def remaining(self):
+        return len(self.data) - self.pos
+
+    def read(self, size):
+        if self.pos + size > len(self.data):
+            raise SerializationError('Read past the end of the data')
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+    def unpack(self, fmt):
+        packer = struct.Struct('<' + fmt)
+        return packer.unpack(self.read(packer.size))[0]
+
+    def varuint32(self):
+        value = shift = 0
+        while True:
+            b = self.read(1)[0]
+            value |= (b & 0x7f) << shift
+            if not b & 0x80:
+                return value
+            shift += 7
+
+    def bytes(self):
+        return self.read(self.varuint32())
+
+    def string(self):
+        return self.bytes().decode('utf-8')
+
+    def name(self):
+        return name_to_string(self.unpack('Q'))
+
+    def array(self, item):
+        return [item() for _ in range(self.varuint32())]
+
+
+def decode_abi(data):
+    # Binary abi_def, as returned by get_raw_code_and_abi, to its JSON form.
+    # Extensions newer than action_results are left out
+    r = BinaryReader(data)
+    abi = {
+        'version': r.string(),
+        'types': r.array(lambda: {'new_type_name': r.string(), 'type': r.string()}),
+        'structs': r.array(lambda: {
+            'name': r.string(), 'base': r.string(),
+            'fields': r.array(lambda: {'name': r.string(), 'type': r.string()})}),
+        'actions': r.array(lambda: {'name': r.name(), 'type': r.string(), 'ricardian_contract': r.string()}),
+        'tables': r.array(lambda: {
+            'name': r.name(), 'index_type': r.string(), 'key_names': r.array(r.string),
+            'key_types': r.array(r.string), 'type': r.string()}),
+        'ricardian_clauses': r.array(lambda: {'id': r.string(), 'body': r.string()}),
+        'error_messages': r.array(lambda: {'error_code': r.unpack('Q'), 'error_msg': r.string()}),
+        'abi_extensions': r.array(lambda: {'tag': r.unpack('H'), 'value': binascii.hexlify(r.bytes()).decode()}),
+    }
+    abi['variants'] = r.array(lambda: {'name': r.string(), 'types': r.array(r.string)}) if r.remaining() else []
+    abi['action_results'] = r.array(lambda: {'name': r.name(), 'result_type': r.string()}) if r.remaining() else []
+    return abi
+
+
+def canonical_abi(abi):
+    # Same ABI, same bytes: every section present, defaults filled in and
+    # keys sorted, so JSON ABIs and decoded binary ABIs compare equal
+    def entries(section, fields):
+        return [{name: entry.get(name, default) for name, default in fields} for entry in abi.get(section, [])]
+
+    canonical = {
+        'version': abi.get('version', ''),
+        'types': entries('types', [('new_type_name', ''), ('type', '')]),
+        'structs': [{'name': s['name'], 'base': s.get('base', ''),
+                     'fields': [{'name': f['name'], 'type': f['type']} for f in s.get('fields', [])]}
+                    for s in abi.get('structs', [])],
+        'actions': entries('actions', [('name', ''), ('type', ''), ('ricardian_contract', '')]),
+        'tables': entries('tables', [('name', ''), ('index_type', ''), ('key_names', []),
+                                     ('key_types', []), ('type', '')]),
+        'ricardian_clauses': entries('ricardian_clauses', [('id', ''), ('body', '')]),
+        'error_messages': entries('error_messages', [('error_code', 0), ('error_msg', '')]),
+        'abi_extensions': entries('abi_extensions', [('tag', 0), ('value', '')]),
+        'variants': entries('variants', [('name', ''), ('types', [])]),
+        'action_results': entries('action_results', [('name', ''), ('result_type', '')]),
+    }
+    for message in canonical['error_messages']:
+        message['error_code'] = int(message['error_code'])
+    return json.dumps(canonical, sort_keys=True, separators=(',', ':')).encode()
+
+
+def decode_transaction(data):
+    # Packed transaction back to the dict encode_transaction takes
+    r = BinaryReader(data)
+    trx = {'expiration': r.unpack('I'), 'ref_block_num': r.unpack('H'), 'ref_block_prefix': r.unpack('I'),
+           'max_net_usage_words': r.varuint32(), 'max_cpu_usage_ms': r.unpack('B'), 'delay_sec': r.varuint32()}
+
+    def action():
+        return {'account': r.name(), 'name': r.name(),
+                'authorization': r.array(lambda: {'actor': r.name(), 'permission': r.name()}),
+                'data': binascii.hexlify(r.bytes()).decode()}
+
+    trx['context_free_actions'] = r.array(action)
+    trx['actions'] = r.array(action)
+    return trx
+
+
+def private_key_from_wif(wif):
+    raw = base58_decode(wif)
+    if len(raw) != 37 or raw[0] != 0x80:
+        raise SerializationError('Invalid WIF private key')
+    if hashlib.sha256(hashlib.sha256(raw[:33]).digest()).digest()[:4] != raw[33:]:
+        raise SerializationError('Invalid WIF private key checksum')
+    return raw[1:33]
+
+
+def signature_to_string(data):
+    # 65 byte compact signature, recovery byte first
+    return 'SIG_K1_' + base58_encode(data + ripemd160(data + b'K1')[:4])
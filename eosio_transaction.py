@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import hashlib
+import binascii
+import calendar
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from eosio_serializer import (encode_transaction, private_key_from_wif, signature_to_string,
+                              base58_decode)
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+# Canonical signatures are tried with expirations this many seconds apart
+MAX_SIGN_ATTEMPTS = 100
+
+
+def is_canonical(signature):
+    # nodeos only accepts compact signatures whose r and s have no padding byte
+    # in DER form, signature is the recovery byte followed by r and s
+    r, s = signature[1:33], signature[33:65]
+    return not (r[0] & 0x80) and not (r[0] == 0 and not (r[1] & 0x80)) and \
+        not (s[0] & 0x80) and not (s[0] == 0 and not (s[1] & 0x80))
+
+
+def signing_digest(chain_id, packed_trx):
+    # No context free data, so its hash is all zeros
+    return hashlib.sha256(binascii.unhexlify(chain_id) + packed_trx + bytes(32)).digest()
+
+
+_process_key = None
+
+
+def _init_process_key(wif):
+    global _process_key
+    import eospy.keys
+    _process_key = eospy.keys.EOSKey(wif)
+
+
+def _sign_in_process(digest):
+    # EOSKey returns the string form, back to the compact bytes
+    return base58_decode(_process_key.sign(binascii.hexlify(digest).decode())[len('SIG_K1_'):])[:65]
+
+
+class Signer:
+    # Signs digests with a single key. libsecp256k1 through coincurve when it
+    # is installed, else eospy's pure Python EOSKey in a pool of processes so
+    # concurrent pushes don't serialize on the GIL
+
+    def __init__(self, wif, workers=0):
+        self.pool = None
+        if coincurve is not None:
+            self.key = coincurve.PrivateKey(private_key_from_wif(wif))
+        else:
+            self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                            initializer=_init_process_key, initargs=(wif,))
+
+    @property
+    def backend(self):
+        return 'coincurve' if self.pool is None else 'eospy'
+
+    def sign(self, digest):
+        # Returns the compact signature, None when it isn't canonical
+        if self.pool is not None:
+            signature = self.pool.submit(_sign_in_process, digest).result()
+        else:
+            # r, s and the recovery id, nodeos wants the id first as 31 + id
+            recoverable = self.key.sign_recoverable(digest, hasher=None)
+            signature = bytes([recoverable[64] + 31]) + recoverable[:64]
+        return signature if is_canonical(signature) else None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def parse_block_time(value):
+    return calendar.timegm(time.strptime(value.split('.')[0], '%Y-%m-%dT%H:%M:%S'))
+
+
+class TransactionBuilder:
+    # Packs and signs transactions locally. The chain id, the TAPOS reference
+    # and the offset of the chain clock come from get_info, which is called
+    # again only once the cached values are refresh seconds old
+
+    def __init__(self, get_info, signer, expiration=120, refresh=60):
+        self.get_info = get_info
+        self.signer = signer
+        self.expiration = expiration
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.context = None
+        self.fetched = 0
+
+    def chain_context(self):
+        with self.lock:
+            if self.context is None or time.monotonic() - self.fetched >= self.refresh:
+                info = self.get_info()
+                block_id = binascii.unhexlify(info['last_irreversible_block_id'])
+                self.context = {
+                    'chain_id': info['chain_id'],
+                    'head_block_num': info['head_block_num'],
+                    'ref_block': info['last_irreversible_block_num'],
+                    'ref_block_num': info['last_irreversible_block_num'] & 0xffff,
+                    'ref_block_prefix': int.from_bytes(block_id[8:12], 'little'),
+                    'clock_offset': parse_block_time(info['head_block_time']) - time.time(),
+                }
+                self.fetched = time.monotonic()
+            return self.context
+
+    def build(self, actions, expires_at=None):
+        # Returns the push_transaction body and the transaction id. Expires
+        # expiration seconds from the chain clock, or at expires_at
+        context = self.chain_context()
+        expires = expires_at or int(time.time() + context['clock_offset']) + self.expiration
+        # Another expiration changes the digest, nodeos checks uniqueness by id
+        for attempt in range(MAX_SIGN_ATTEMPTS):
+            packed = encode_transaction({'expiration': expires - attempt, 'ref_block_num': context['ref_block_num'],
+                                         'ref_block_prefix': context['ref_block_prefix'], 'actions': actions})
+            signature = self.signer.sign(signing_digest(context['chain_id'], packed))
+            if signature is not None:
+                return {'signatures': [signature_to_string(signature)], 'compression': 'none',
+                        'packed_context_free_data': '', 'packed_trx': binascii.hexlify(packed).decode()}, \
+                    hashlib.sha256(packed).hexdigest()
+        raise ValueError('No canonical signature after {} attempts'.format(MAX_SIGN_ATTEMPTS))
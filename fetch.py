@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHUNK_SIZE = 1024 * 1024
+RETRY_STATUS = [500, 502, 503, 504]
+
+
+class FetchError(Exception):
+    pass
+
+
+class FetchCache:
+    # Content addressed download cache. Files are stored by sha256 under
+    # objects/, index.json maps every URL to its current object and the
+    # validators the server sent. Cached URLs are revalidated with
+    # If-None-Match/If-Modified-Since once older than max_age seconds, files
+    # pinned to a sha256 never are. Interrupted downloads are kept under
+    # partial/ and resumed with a Range request
+
+    def __init__(self, cache_dir, max_age=0, chunk_size=CHUNK_SIZE, retries=3, timeout=60, backoff=1):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, 'partial'), exist_ok=True)
+        self.index_file = os.path.join(cache_dir, 'index.json')
+        try:
+            with open(self.index_file) as fin:
+                self.index = json.load(fin)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def object_path(self, digest):
+        return os.path.join(self.cache_dir, 'objects', digest[:2], digest)
+
+    def _partial_path(self, url):
+        return os.path.join(self.cache_dir, 'partial', hashlib.sha256(url.encode()).hexdigest())
+
+    def _update_index(self, url, **entry):
+        with self.lock:
+            self.index.setdefault(url, {}).update(entry)
+            with open(self.index_file + '.tmp', 'w') as fout:
+                json.dump(self.index, fout, indent=2, sort_keys=True)
+            os.replace(self.index_file + '.tmp', self.index_file)
+
+    def _cached(self, url, sha256):
+        # Path of a cached copy that can be used without asking the server
+        if sha256 and os.path.exists(self.object_path(sha256)):
+            return self.object_path(sha256)
+        entry = self.index.get(url)
+        if entry and not sha256 and os.path.exists(self.object_path(entry['sha256'])):
+            if self.max_age and time.time() - entry['checked'] < self.max_age:
+                return self.object_path(entry['sha256'])
+        return None
+
+    def fetch(self, url, sha256=None):
+        for _ in self.iter_chunks(url, sha256, read=False):
+            pass
+        return self.path(url)
+
+    def path(self, url):
+        return self.object_path(self.index[url]['sha256'])
+
+    def fetch_all(self, urls, workers=4):
+        # urls is a list of url or (url, sha256), the paths come back in the same order
+        items = [(u, None) if isinstance(u, str) else u for u in urls]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda item: self.fetch(*item), items))
+
+    def iter_chunks(self, url, sha256=None, read=True):
+        # Yields the content of url while it is downloaded into the cache, or
+        # from the cache when it is fresh. With read=False cached content is
+        # not read at all
+        cached = self._cached(url, sha256)
+        if cached:
+            digest = os.path.basename(cached)
+            if self.index.get(url, {}).get('sha256') != digest:
+                self._update_index(url, sha256=digest, checked=time.time())
+            yield from self._read(cached, read)
+            return
+
+        # A retry yields only what the failed attempt had not
+        sent = [0]
+        attempt = 0
+        while True:
+            try:
+                result = yield from self._download(url, sha256, read, sent)
+                break
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                error = e
+            except FetchError as e:
+                if not getattr(e, 'retry', False):
+                    raise
+                error = e
+            if attempt >= self.retries:
+                raise FetchError('Error downloading {}: {}'.format(url, error))
+            attempt += 1
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        if result is not None:
+            yield from self._read(result, read)
+
+    def _read(self, filename, read):
+        if not read:
+            return
+        with open(filename, 'rb') as fin:
+            for block in iter(lambda: fin.read(self.chunk_size), b''):
+                yield block
+
+    def _download(self, url, sha256, read, sent):
+        # Returns the path of a cached object still to be read, or None when
+        # everything was yielded while downloading
+        entry = self.index.get(url, {})
+        partial = self._partial_path(url)
+        headers = {}
+        # A pinned file isn't cached yet, whatever the server says about the
+        # copy we have
+        if entry and not sha256 and os.path.exists(self.object_path(entry['sha256'])):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        # A partial download is only resumed when the server can tell it is
+        # still the same file
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        validator = self._partial_validator(partial)
+        if offset and validator:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = validator
+
+        position = 0
+
+        def unsent(block):
+            nonlocal position
+            start = max(sent[0] - position, 0)
+            position += len(block)
+            if start < len(block):
+                sent[0] += len(block) - start
+                return block[start:]
+            return b''
+
+        with self._session().get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304:
+                self._update_index(url, checked=time.time())
+                return self.object_path(entry['sha256'])
+            if response.status_code in RETRY_STATUS:
+                error = FetchError('HTTP {} for {}'.format(response.status_code, url))
+                error.retry = True
+                raise error
+            response.raise_for_status()
+
+            h = hashlib.sha256()
+            mode = 'wb'
+            if response.status_code == 206:
+                mode = 'ab'
+                with open(partial, 'rb') as fin:
+                    for block in iter(lambda: fin.read(self.chunk_size), b''):
+                        h.update(block)
+                        if read:
+                            data = unsent(block)
+                            if data:
+                                yield data
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            self._save_partial_validator(partial, etag or last_modified)
+
+            with open(partial, mode) as fout:
+                for block in response.iter_content(self.chunk_size):
+                    fout.write(block)
+                    fout.flush()
+                    h.update(block)
+                    if read:
+                        data = unsent(block)
+                        if data:
+                            yield data
+
+        digest = h.hexdigest()
+        if sha256 and digest != sha256:
+            self._remove_partial(partial)
+            raise FetchError('Checksum of {} is {}, expected {}'.format(url, digest, sha256))
+        os.makedirs(os.path.dirname(self.object_path(digest)), exist_ok=True)
+        os.replace(partial, self.object_path(digest))
+        self._remove_partial(partial)
+        self._update_index(url, sha256=digest, etag=etag, last_modified=last_modified,
+                           size=os.path.getsize(self.object_path(digest)), checked=time.time())
+        return None
+
+    def _remove_partial(self, partial):
+        for filename in [partial, partial + '.validator']:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def _partial_validator(self, partial):
+        try:
+            with open(partial + '.validator') as fin:
+                return fin.read().strip()
+        except OSError:
+            return None
+
+    def _save_partial_validator(self, partial, validator):
+        if validator:
+            with open(partial + '.validator', 'w') as fout:
+                fout.write(validator)
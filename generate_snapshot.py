@@ -4,10 +4,14 @@ import logging
 import argparse
 import os
 import colorlog
-import requests
 import inspect
 import hashlib
 import pandas
+import csv
+import metrics
+from eosio_asset import UNIT, to_units, format_units, parse_amounts, format_amounts, total, cap
+from snapshot_format import SnapshotWriter
+from fetch import FetchCache, FetchError
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-v", '--verbose', action="store_true",
@@ -16,11 +20,18 @@ parser.add_argument("-d", '--debug', action="store_true",
                     dest="debug", help='Print debug info')
 parser.add_argument('-l', '--log_file', default='{}.log'.format(
     os.path.basename(__file__).split('.')[0]), help='Log file')
+parser.add_argument('-s', '--stream', action="store_true", dest="stream",
+                    help='Hash, parse, cap and write the snapshot in a single pass')
+parser.add_argument('--cache_dir', default='{}/.cache'.format(os.path.dirname(os.path.abspath(__file__))),
+                    help='Download cache directory')
+metrics.add_arguments(parser)
 args = parser.parse_args()
 
 VERBOSE = args.verbose
 DEBUG = args.debug
 LOG_FILE = args.log_file
+STREAM = args.stream
+CACHE_DIR = args.cache_dir
 
 
 logger = logging.getLogger(__name__)
@@ -41,13 +52,15 @@ fh.setFormatter(formatter)
 SCRIPT_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
 
-def download_file(filename, url):
-    with open(filename, 'wb') as fout:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        # Write response data to file
-        for block in response.iter_content(4096):
-            fout.write(block)
+EOS_GENESIS_URL = 'https://raw.githubusercontent.com/eoscafe/eos-snapshot-validation/master/eosnewyork/snapshot.csv'
+EOS_GENESIS_HASH = '6df61f12f96f89c907fac14a021d788c9e77098952a6c5494c7999d2e79d0a35'
+EOS_GENESIS_FILE = SCRIPT_PATH + '/snapshot.csv'
+TELOS_GENESIS_FILE = SCRIPT_PATH + '/eosmetal_telos_snapshot.csv'
+TELOS_GENESIS_BINARY = SCRIPT_PATH + '/eosmetal_telos_snapshot.bin'
+EOS_GENESIS_BALANCE = to_units('996690678.8329')
+TELOS_GENESIS_BALANCE = to_units('178473249.3125')
+BALANCE_CAP = 40000 * UNIT
+CHUNK_SIZE = 1024 * 1024
 
 
 def sha256sum(filename):
@@ -58,52 +71,137 @@ def sha256sum(filename):
     return h.hexdigest()
 
 
-def main():
-    EOS_GENESIS_HASH = '6df61f12f96f89c907fac14a021d788c9e77098952a6c5494c7999d2e79d0a35'
-    EOS_GENESIS_FILE = SCRIPT_PATH + '/snapshot.csv'
-    TELOS_GENESIS_FILE = SCRIPT_PATH + '/eosmetal_telos_snapshot.csv'
-    EOS_GENESIS_BALANCE = 996690678.8328998
-    TELOS_GENESIS_BALANCE = 178473249.3125
-
-    # Get EOS genesis file from EOS Authority and check the hash
-    if not os.path.exists(EOS_GENESIS_FILE):
-        logger.info('Downloading EOS genesis')
-        download_file(SCRIPT_PATH + '/snapshot.csv',
-                      'https://raw.githubusercontent.com/eoscafe/eos-snapshot-validation/master/eosnewyork/snapshot.csv')
-
-    eos_genesis_checksum = sha256sum(EOS_GENESIS_FILE)
-    logger.debug('EOS genesis checksum: {}'.format(eos_genesis_checksum))
-    if eos_genesis_checksum == EOS_GENESIS_HASH:
+def read_chunks(filename, url):
+    # Local copy if there is one, otherwise the cached download, which is
+    # filled on the way when it isn't there yet
+    if os.path.exists(filename):
+        with open(filename, 'rb') as fin:
+            for block in iter(lambda: fin.read(CHUNK_SIZE), b''):
+                yield block
+        return
+
+    logger.info('Getting EOS genesis from {}'.format(url))
+    yield from FetchCache(CACHE_DIR).iter_chunks(url)
+
+
+def read_lines(chunks):
+    remainder = b''
+    for block in chunks:
+        lines = (remainder + block).split(b'\n')
+        remainder = lines.pop()
+        yield from lines
+    if remainder:
+        yield remainder
+
+
+def stream_snapshot():
+    h = hashlib.sha256()
+    eos_total_balance = 0
+    telos_total_balance = 0
+
+    def hashed(chunks):
+        for block in chunks:
+            h.update(block)
+            yield block
+
+    lines = read_lines(hashed(read_chunks(EOS_GENESIS_FILE, EOS_GENESIS_URL)))
+    rows = csv.reader(line.decode() for line in lines if line.strip())
+    with open(TELOS_GENESIS_FILE + '.tmp', 'w') as fout, SnapshotWriter(TELOS_GENESIS_BINARY) as writer:
+        for index, (eth_address, eos_account, eos_address, balance) in enumerate(rows):
+            units = to_units(balance)
+            capped = min(units, BALANCE_CAP)
+            eos_total_balance += units
+            telos_total_balance += capped
+            # Same layout pandas to_csv wrote, index first
+            fout.write('{},{},{},{},{}\n'.format(index, eth_address, eos_account, eos_address, format_units(capped)))
+            writer.append(eth_address, eos_account, eos_address, capped)
+            if index % 10000 == 0:
+                metrics.gauge('accounts_written', index + 1)
+        metrics.gauge('accounts_written', writer.count)
+
+        # Every check runs before the block is left, exiting from inside it
+        # discards the binary snapshot, and the csv is only renamed after
+        def fail(message):
+            logger.critical(message)
+            fout.close()
+            os.remove(TELOS_GENESIS_FILE + '.tmp')
+            exit(1)
+
+        eos_genesis_checksum = h.hexdigest()
+        logger.debug('EOS genesis checksum: {}'.format(eos_genesis_checksum))
+        if eos_genesis_checksum != EOS_GENESIS_HASH:
+            fail('EOS genesis checksum failed')
         logger.info('EOS genesis checksum OK')
+
+        logger.debug('EOS genesis total balance: {} EOS'.format(format_units(eos_total_balance)))
+        if eos_total_balance != EOS_GENESIS_BALANCE:
+            fail('EOS genesis balance is wrong')
+        logger.info('EOS genesis balance correct')
+
+        logger.debug('TELOS genesis total balance: {} TLOS'.format(format_units(telos_total_balance)))
+        if telos_total_balance != TELOS_GENESIS_BALANCE:
+            fail('TELOS genesis balance is wrong')
+        logger.info('TELOS genesis balance correct')
+
+    os.rename(TELOS_GENESIS_FILE + '.tmp', TELOS_GENESIS_FILE)
+
+
+def main():
+    if STREAM:
+        stream_snapshot()
+        return
+
+    # Get EOS genesis file from EOS Authority and check the hash, the cache
+    # checks it against the pinned hash itself
+    eos_genesis_file = EOS_GENESIS_FILE
+    if os.path.exists(EOS_GENESIS_FILE):
+        eos_genesis_checksum = sha256sum(EOS_GENESIS_FILE)
+        logger.debug('EOS genesis checksum: {}'.format(eos_genesis_checksum))
+        if eos_genesis_checksum != EOS_GENESIS_HASH:
+            logger.critical('EOS genesis checksum failed')
+            exit(1)
     else:
-        logger.critical('EOS genesis checksum failed')
-        exit(1)
+        logger.info('Getting EOS genesis from {}'.format(EOS_GENESIS_URL))
+        try:
+            eos_genesis_file = FetchCache(CACHE_DIR).fetch(EOS_GENESIS_URL, EOS_GENESIS_HASH)
+        except FetchError as e:
+            logger.critical('Error getting EOS genesis: {}'.format(e))
+            exit(1)
+    logger.info('EOS genesis checksum OK')
 
     # Apply the cap and check the balances
-    eos_genesis = pandas.read_csv(EOS_GENESIS_FILE, names=['eth_address',
-                                                           'eos_account', 'eos_address', 'balance'])
+    eos_genesis = pandas.read_csv(eos_genesis_file, names=['eth_address',
+                                                           'eos_account', 'eos_address', 'balance'], dtype={'balance': str})
+    balances = parse_amounts(eos_genesis['balance'])
 
-    eos_total_balance = eos_genesis['balance'].sum()
+    eos_total_balance = total(balances)
     logger.debug(
-        'EOS genesis total balance: {} EOS'.format(eos_total_balance))
+        'EOS genesis total balance: {} EOS'.format(format_units(eos_total_balance)))
     if eos_total_balance != EOS_GENESIS_BALANCE:
         logger.critical('EOS genesis balance is wrong')
         exit(1)
     else:
         logger.info('EOS genesis balance correct')
 
-    eos_genesis['balance'] = eos_genesis['balance'].apply(
-        lambda x: x if x < 40000.0 else 40000.0)
-    telos_total_balance = eos_genesis['balance'].sum()
+    balances = cap(balances, BALANCE_CAP)
+    eos_genesis['balance'] = format_amounts(balances)
+    telos_total_balance = total(balances)
     logger.debug('TELOS genesis total balance: {} TLOS'.format(
-        telos_total_balance))
-    eos_genesis.to_csv(TELOS_GENESIS_FILE, header=False, float_format='%.4f')
+        format_units(telos_total_balance)))
+    # Checked before anything is written, the tools load these files by default
     if telos_total_balance != TELOS_GENESIS_BALANCE:
         logger.critical('TELOS genesis balance is wrong')
         exit(1)
     else:
         logger.info('TELOS genesis balance correct')
 
+    eos_genesis.to_csv(TELOS_GENESIS_FILE + '.tmp', header=False)
+    with SnapshotWriter(TELOS_GENESIS_BINARY) as writer:
+        for row in zip(eos_genesis['eth_address'], eos_genesis['eos_account'], eos_genesis['eos_address'], balances):
+            writer.append(*row)
+    os.rename(TELOS_GENESIS_FILE + '.tmp', TELOS_GENESIS_FILE)
+    metrics.gauge('accounts_written', writer.count)
+
 
 if __name__ == "__main__":
-    main()
+    metrics.run(main, args)
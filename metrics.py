@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import cProfile
+import asyncio
+import functools
+import threading
+import logging
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PREFIX = 'eosio_boot_'
+# Upper bounds in seconds of the timer histogram buckets
+BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60]
+
+logger = logging.getLogger(__name__)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+class Metrics:
+    # Process wide counters, gauges and timers, each keyed by name and labels.
+    # Timers keep a count, sum, max and histogram buckets, so recording one is
+    # cheap enough for the hot paths
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(BUCKETS)}
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    timer['buckets'][i] += 1
+                    break
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        # Decorator timing every call, for plain and async functions
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        def key_name(name, labels):
+            return name + _format_labels(labels)
+
+        with self.lock:
+            timers = {key_name(*key): {'count': t['count'], 'sum': round(t['sum'], 6), 'max': round(t['max'], 6),
+                                       'avg': round(t['sum'] / t['count'], 6) if t['count'] else 0}
+                      for key, t in sorted(self.timers.items())}
+            return {
+                'time': time.time(),
+                'uptime': round(time.time() - self.started, 3),
+                'counters': {key_name(*key): value for key, value in sorted(self.counters.items())},
+                'gauges': {key_name(*key): value for key, value in sorted(self.gauges.items())},
+                'timers': timers,
+            }
+
+    def prometheus(self):
+        # Text exposition format, counters and gauges as they are, timers as
+        # histograms in seconds
+        lines = []
+        with self.lock:
+            for kind, values in [('counter', self.counters), ('gauge', self.gauges)]:
+                for name in sorted(set(name for name, _ in values)):
+                    metric = PREFIX + name
+                    lines.append('# TYPE {} {}'.format(metric, kind))
+                    for (other, labels), value in sorted(values.items()):
+                        if other == name:
+                            lines.append('{}{} {}'.format(metric, _format_labels(labels), value))
+            for name in sorted(set(name for name, _ in self.timers)):
+                metric = PREFIX + name
+                lines.append('# TYPE {} histogram'.format(metric))
+                for (other, labels), timer in sorted(self.timers.items()):
+                    if other != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, timer['buckets']):
+                        cumulative += count
+                        lines.append('{}_bucket{} {}'.format(metric, _format_labels(labels, [('le', bound)]), cumulative))
+                    lines.append('{}_bucket{} {}'.format(metric, _format_labels(labels, [('le', '+Inf')]), timer['count']))
+                    lines.append('{}_sum{} {}'.format(metric, _format_labels(labels), timer['sum']))
+                    lines.append('{}_count{} {}'.format(metric, _format_labels(labels), timer['count']))
+            lines.append('# TYPE {}uptime_seconds gauge'.format(PREFIX))
+            lines.append('{}uptime_seconds {}'.format(PREFIX, time.time() - self.started))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        with open(filename + '.tmp', 'w') as fout:
+            json.dump(self.snapshot(), fout, indent=2)
+        os.replace(filename + '.tmp', filename)
+
+
+metrics = Metrics()
+inc = metrics.inc
+gauge = metrics.gauge
+observe = metrics.observe
+timer = metrics.timer
+timed = metrics.timed
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = metrics.prometheus().encode(), 'text/plain; version=0.0.4'
+        elif self.path == '/stats':
+            body, content_type = json.dumps(metrics.snapshot()).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Exporter:
+    # Serves /metrics and /stats on port and rewrites the JSON stats file every
+    # interval seconds, both from daemon threads
+
+    def __init__(self, port=0, filename=None, interval=10):
+        self.filename = filename
+        self.interval = interval
+        self.stop = threading.Event()
+        self.server = None
+        self.threads = []
+        if port:
+            self.server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+            self.server.daemon_threads = True
+            self.threads.append(threading.Thread(target=self.server.serve_forever, daemon=True))
+        if filename:
+            self.threads.append(threading.Thread(target=self._write_periodically, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def _write_periodically(self):
+        while not self.stop.wait(self.interval):
+            try:
+                metrics.write(self.filename)
+            except OSError as e:
+                logger.warning('Error writing stats file {}: {}'.format(self.filename, e))
+
+    def close(self):
+        self.stop.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.filename:
+            metrics.write(self.filename)
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics_port', type=int, default=0,
+                        help='Serve Prometheus metrics on /metrics and JSON on /stats at this port')
+    parser.add_argument('--metrics_file',
+                        help='JSON file the metrics are written to periodically and at exit')
+    parser.add_argument('--metrics_interval', type=float, default=10,
+                        help='Seconds between writes of the metrics file')
+    parser.add_argument('--profile',
+                        help='Run under cProfile and save the stats to this file')
+
+
+def run(main, args):
+    # Runs a tool's main with the exporters and profiler its arguments ask for
+    exporter = Exporter(args.metrics_port, args.metrics_file, args.metrics_interval)
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        if profiler:
+            profiler.enable()
+        main()
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        exporter.close()
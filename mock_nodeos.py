@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+import time
+import json
+import random
+import struct
+import hashlib
+import asyncio
+import threading
+import binascii
+import numpy as np
+from aiohttp import web
+from eosio_asset import format_asset
+from eosio_serializer import AbiSerializer, name_to_string, bytes_to_public_key, decode_transaction
+
+# Enough of the eosio and eosio.token ABIs for the actions the tools push
+NAME_ABI_TYPES = [{'new_type_name': 'account_name', 'type': 'name'},
+                  {'new_type_name': 'permission_name', 'type': 'name'}]
+AUTHORITY_STRUCTS = [
+    {'name': 'permission_level', 'base': '', 'fields': [
+        {'name': 'actor', 'type': 'name'}, {'name': 'permission', 'type': 'name'}]},
+    {'name': 'key_weight', 'base': '', 'fields': [
+        {'name': 'key', 'type': 'public_key'}, {'name': 'weight', 'type': 'uint16'}]},
+    {'name': 'permission_level_weight', 'base': '', 'fields': [
+        {'name': 'permission', 'type': 'permission_level'}, {'name': 'weight', 'type': 'uint16'}]},
+    {'name': 'wait_weight', 'base': '', 'fields': [
+        {'name': 'wait_sec', 'type': 'uint32'}, {'name': 'weight', 'type': 'uint16'}]},
+    {'name': 'authority', 'base': '', 'fields': [
+        {'name': 'threshold', 'type': 'uint32'}, {'name': 'keys', 'type': 'key_weight[]'},
+        {'name': 'accounts', 'type': 'permission_level_weight[]'}, {'name': 'waits', 'type': 'wait_weight[]'}]},
+]
+ABIS = {
+    'eosio': {
+        'version': 'eosio::abi/1.1',
+        'types': NAME_ABI_TYPES,
+        'structs': AUTHORITY_STRUCTS + [
+            {'name': 'newaccount', 'base': '', 'fields': [
+                {'name': 'creator', 'type': 'name'}, {'name': 'name', 'type': 'name'},
+                {'name': 'owner', 'type': 'authority'}, {'name': 'active', 'type': 'authority'}]},
+            {'name': 'buyrambytes', 'base': '', 'fields': [
+                {'name': 'payer', 'type': 'name'}, {'name': 'receiver', 'type': 'name'},
+                {'name': 'bytes', 'type': 'uint32'}]},
+            {'name': 'delegatebw', 'base': '', 'fields': [
+                {'name': 'from', 'type': 'name'}, {'name': 'receiver', 'type': 'name'},
+                {'name': 'stake_net_quantity', 'type': 'asset'}, {'name': 'stake_cpu_quantity', 'type': 'asset'},
+                {'name': 'transfer', 'type': 'bool'}]},
+            {'name': 'blockchain_parameters', 'base': '', 'fields': [
+                {'name': 'max_block_cpu_usage', 'type': 'uint32'},
+                {'name': 'max_transaction_cpu_usage', 'type': 'uint32'},
+                {'name': 'max_transaction_net_usage', 'type': 'uint32'},
+                {'name': 'max_transaction_lifetime', 'type': 'uint32'}]},
+            {'name': 'setparams', 'base': '', 'fields': [
+                {'name': 'params', 'type': 'blockchain_parameters'}]},
+        ],
+        'actions': [{'name': name, 'type': name, 'ricardian_contract': ''}
+                    for name in ['newaccount', 'buyrambytes', 'delegatebw', 'setparams']],
+        'tables': [], 'ricardian_clauses': [], 'error_messages': [], 'abi_extensions': [],
+    },
+    'eosio.token': {
+        'version': 'eosio::abi/1.1',
+        'types': NAME_ABI_TYPES,
+        'structs': [
+            {'name': 'transfer', 'base': '', 'fields': [
+                {'name': 'from', 'type': 'name'}, {'name': 'to', 'type': 'name'},
+                {'name': 'quantity', 'type': 'asset'}, {'name': 'memo', 'type': 'string'}]},
+        ],
+        'actions': [{'name': 'transfer', 'type': 'transfer', 'ricardian_contract': ''}],
+        'tables': [], 'ricardian_clauses': [], 'error_messages': [], 'abi_extensions': [],
+    },
+}
+GLOBAL_PARAMS = {'max_block_cpu_usage': 200000, 'max_transaction_cpu_usage': 150000,
+                 'max_transaction_net_usage': 524288, 'max_transaction_lifetime': 3600}
+CHAIN_ID = hashlib.sha256(b'mock nodeos').hexdigest()
+CPU_US_PER_ACTION = 25
+NET_WORDS_PER_ACTION = 16
+UNKNOWN_KEY = {'code': 500, 'message': 'Internal Service Error', 'error': {
+    'code': 3010001, 'name': 'name_type_exception', 'what': 'unknown key',
+    'details': [{'message': 'unknown key (eosio::chain::name)', 'file': '', 'line_number': 0, 'method': ''}]}}
+
+
+def transaction_error(code, name, message):
+    return {'code': 500, 'message': 'Internal Service Error', 'error': {
+        'code': code, 'name': name, 'what': message,
+        'details': [{'message': message, 'file': '', 'line_number': 0, 'method': ''}]}}
+
+
+def block_id(block_num):
+    # Block number big endian in the first four bytes like nodeos, the rest
+    # derived from it so ref_block_prefix stays stable
+    return '{:08x}'.format(block_num) + hashlib.sha256(str(block_num).encode()).hexdigest()[8:]
+
+
+class MockNodeos:
+    # Local stand-in for the nodeos chain API the tools call. Every request
+    # waits latency seconds plus up to jitter more, and fails with a 503 at
+    # error_rate. Accounts are plain dicts, pushed transactions create the
+    # accounts of their newaccount actions, a 'threshold' entry changes the
+    # threshold of their permissions. Packed transactions are checked for
+    # their expiration and TAPOS reference, setparams changes the global
+    # row. Request counts and latencies are kept per path for the benchmark
+    # report
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.accounts = {}
+        self.contracts = {}
+        self.files = {}
+        self.serializers = {account: AbiSerializer(abi) for account, abi in ABIS.items()}
+        self.head_block_num = 1
+        self.params = dict(GLOBAL_PARAMS)
+        self.scopes = None
+        self.voters = None
+        self.url = None
+        self.loop = None
+        self.thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.requests = {}
+        self.latencies = []
+        self.errors = 0
+
+    def add_accounts(self, accounts, keys, liquid, staked):
+        for account, key, liquid_units, staked_units in zip(accounts, keys, liquid, staked):
+            self.accounts[account] = {'key': key, 'liquid': int(liquid_units), 'staked': int(staked_units)}
+        self.scopes = self.voters = None
+
+    def add_contract(self, account, wasm, abi):
+        self.contracts[account] = (hashlib.sha256(wasm).hexdigest(), abi)
+
+    def add_file(self, name, data):
+        self.files[name] = data
+
+    def stats(self):
+        latencies = np.array(self.latencies or [0.0]) * 1000
+        return {
+            'rpcs': sum(self.requests.values()),
+            'errors': self.errors,
+            'requests': dict(sorted(self.requests.items())),
+            'latency_ms': {'p50': round(float(np.percentile(latencies, 50)), 3),
+                           'p99': round(float(np.percentile(latencies, 99)), 3)},
+        }
+
+    def start(self, host='127.0.0.1', port=0):
+        # Serves from a thread of its own, returns the base URL
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start(host, port))
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.runner.cleanup())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self.url
+
+    async def _start(self, host, port):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/v1/chain/{method}', self._chain)
+        app.router.add_get('/files/{name}', self._file)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = 'http://{}:{}'.format(host, port)
+
+    def stop(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    async def _file(self, request):
+        name = request.match_info['name']
+        if name not in self.files:
+            raise web.HTTPNotFound()
+        return web.Response(body=self.files[name])
+
+    async def _chain(self, request):
+        start = time.perf_counter()
+        method = request.match_info['method']
+        self.requests[method] = self.requests.get(method, 0) + 1
+        try:
+            if self.latency or self.jitter:
+                await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return web.json_response({'code': 503, 'message': 'Service Unavailable'}, status=503)
+            handler = getattr(self, 'chain_' + method, None)
+            if handler is None:
+                return web.json_response({'code': 404, 'message': 'Not Found'}, status=404)
+            body = await request.read()
+            status, result = handler(json.loads(body) if body else {})
+            return web.json_response(result, status=status)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    def chain_get_info(self, params):
+        return 200, {'chain_id': CHAIN_ID, 'head_block_num': self.head_block_num,
+                     'last_irreversible_block_num': self.head_block_num,
+                     'head_block_id': block_id(self.head_block_num),
+                     'last_irreversible_block_id': block_id(self.head_block_num),
+                     'head_block_time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())}
+
+    def chain_get_block(self, params):
+        block_num = int(params['block_num_or_id'])
+        prefix = int.from_bytes(binascii.unhexlify(block_id(block_num))[8:12], 'little')
+        return 200, {'block_num': block_num, 'id': block_id(block_num), 'ref_block_prefix': prefix, 'transactions': []}
+
+    def chain_get_abi(self, params):
+        return 200, {'account_name': params['account_name'], 'abi': ABIS.get(params['account_name'])}
+
+    def chain_abi_json_to_bin(self, params):
+        serializer = self.serializers.get(params['code'])
+        if serializer is None:
+            return 500, UNKNOWN_KEY
+        return 200, {'binargs': serializer.encode_action(params['action'], params['args'])}
+
+    def chain_get_account(self, params):
+        account = self.accounts.get(params['account_name'])
+        if account is None:
+            return 500, UNKNOWN_KEY
+        auth = {'threshold': account.get('threshold', 1), 'keys': [{'key': account['key'], 'weight': 1}],
+                'accounts': [], 'waits': []}
+        cpu = account['staked'] // 2
+        return 200, {
+            'account_name': params['account_name'],
+            'core_liquid_balance': format_asset(account['liquid']),
+            'total_resources': {'cpu_weight': format_asset(cpu), 'net_weight': format_asset(account['staked'] - cpu)},
+            'permissions': [{'perm_name': 'active', 'parent': 'owner', 'required_auth': auth},
+                            {'perm_name': 'owner', 'parent': '', 'required_auth': auth}],
+        }
+
+    def chain_get_code(self, params):
+        code_hash, abi = self.contracts.get(params['account_name'], ('0' * 64, None))
+        return 200, {'account_name': params['account_name'], 'code_hash': code_hash, 'abi': abi}
+
+    def chain_get_accounts_by_authorizers(self, params):
+        keys = set(params.get('keys', []))
+        rows = []
+        for name, account in self.accounts.items():
+            if account['key'] in keys:
+                for permission in ['owner', 'active']:
+                    rows.append({'account_name': name, 'permission_name': permission,
+                                 'authorizing_key': account['key'], 'weight': 1,
+                                 'threshold': account.get('threshold', 1)})
+        return 200, {'accounts': rows}
+
+    def _page(self, names, lower_bound, limit):
+        # names is sorted, the page starts at lower_bound
+        start = int(np.searchsorted(names, lower_bound)) if lower_bound else 0
+        page = names[start:start + limit]
+        more = names[start + limit] if start + limit < len(names) else ''
+        return page, more
+
+    def chain_get_table_by_scope(self, params):
+        if (params['code'], params['table']) != ('eosio.token', 'accounts'):
+            return 200, {'rows': [], 'more': ''}
+        if self.scopes is None:
+            self.scopes = sorted(name for name, account in self.accounts.items() if account['liquid'])
+        page, more = self._page(self.scopes, params.get('lower_bound'), int(params.get('limit', 10)))
+        return 200, {'rows': [{'code': 'eosio.token', 'scope': name, 'table': 'accounts', 'payer': name, 'count': 1}
+                              for name in page], 'more': more}
+
+    def chain_get_table_rows(self, params):
+        code, scope, table = params['code'], params['scope'], params['table']
+        if (code, table) == ('eosio', 'global'):
+            return 200, {'rows': [dict(self.params)], 'more': False, 'next_key': ''}
+        if (code, table) == ('eosio.token', 'accounts'):
+            account = self.accounts.get(scope)
+            rows = [{'balance': format_asset(account['liquid'])}] if account and account['liquid'] else []
+            return 200, {'rows': rows, 'more': False, 'next_key': ''}
+        if (code, table) == ('eosio', 'voters'):
+            if self.voters is None:
+                self.voters = sorted(self.accounts)
+            page, more = self._page(self.voters, params.get('lower_bound'), int(params.get('limit', 10)))
+            rows = [{'owner': name, 'staked': self.accounts[name]['staked']} for name in page]
+            return 200, {'rows': rows, 'more': bool(more), 'next_key': more}
+        return 200, {'rows': [], 'more': False, 'next_key': ''}
+
+    def _check_transaction(self, trx):
+        # Returns the error nodeos would reject trx with, None when it passes
+        now = int(time.time())
+        if trx['expiration'] <= now:
+            return transaction_error(3040005, 'expired_tx_exception', 'Expired Transaction')
+        if trx['expiration'] > now + self.params['max_transaction_lifetime']:
+            return transaction_error(3040006, 'tx_exp_too_far_exception',
+                                     'Transaction Expiration Too Far')
+        # The summary slot of ref_block_num holds the last block with those low
+        # bits, block 0 left all zeros
+        ref_block = self.head_block_num - ((self.head_block_num - trx['ref_block_num']) & 0xffff)
+        prefix = int.from_bytes(binascii.unhexlify(block_id(ref_block))[8:12], 'little') if ref_block > 0 else 0
+        if ref_block < 0 or trx['ref_block_prefix'] != prefix:
+            return transaction_error(3040007, 'invalid_ref_block_exception',
+                                     'Transaction\'s reference block did not match')
+        return None
+
+    def chain_push_transaction(self, params):
+        # Takes both the packed form and the JSON one eospy sends
+        if 'packed_trx' in params:
+            packed = binascii.unhexlify(params['packed_trx'])
+            trx = decode_transaction(packed)
+            error = self._check_transaction(trx)
+            if error is not None:
+                return 500, error
+            actions = trx['actions']
+            trx_id = hashlib.sha256(packed).hexdigest()
+        else:
+            actions = params['transaction']['actions']
+            trx_id = hashlib.sha256(json.dumps(params['transaction'], sort_keys=True).encode()).hexdigest()
+        for action in actions:
+            if (action['account'], action['name']) == ('eosio', 'newaccount'):
+                data = binascii.unhexlify(action['data'])
+                name = name_to_string(int.from_bytes(data[8:16], 'little'))
+                self.accounts[name] = {'key': self._newaccount_key(data), 'liquid': 0, 'staked': 0}
+            elif (action['account'], action['name']) == ('eosio', 'setparams'):
+                self.params.update(zip(['max_block_cpu_usage', 'max_transaction_cpu_usage',
+                                        'max_transaction_net_usage', 'max_transaction_lifetime'],
+                                       struct.unpack('<IIII', binascii.unhexlify(action['data']))))
+        self.scopes = self.voters = None
+        self.head_block_num += 1
+        return 200, {'transaction_id': trx_id, 'processed': {
+            'id': trx_id, 'block_num': self.head_block_num,
+            'receipt': {'status': 'executed', 'cpu_usage_us': CPU_US_PER_ACTION * len(actions),
+                        'net_usage_words': NET_WORDS_PER_ACTION * len(actions)}}}
+
+    def chain_push_transactions(self, params):
+        results = []
+        for trx in params:
+            status, result = self.chain_push_transaction(trx)
+            if status != 200:
+                result = {'transaction_id': hashlib.sha256(binascii.unhexlify(trx['packed_trx'])).hexdigest(),
+                          'processed': {'except': result['error']}}
+            results.append(result)
+        return 200, results
+
+    def _newaccount_key(self, data):
+        # creator, name, then the owner authority: threshold, key count, first key
+        return bytes_to_public_key(data[21:55]) if data[20] else ''
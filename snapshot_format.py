@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import os
+import struct
+import hashlib
+import numpy as np
+import pandas
+from eosio_asset import format_amounts
+from eosio_serializer import NAME_CHARS, string_to_name, public_key_to_bytes, bytes_to_public_key
+
+# Layout: a 64 byte header followed by one column after another, int64 balances
+# first so every column stays aligned when memory mapped
+#   header   magic, version, row count, sha256 of everything after the header
+#   balance  int64 amount in 1/10000 units
+#   account  uint64 EOSIO name
+#   eth      20 byte ethereum address
+#   key      34 byte public key, key type followed by the compressed point
+MAGIC = b'TLOSSNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQ32s')
+HEADER_SIZE = 64
+ETH_SIZE = 20
+KEY_SIZE = 34
+COLUMNS = ['balance', 'account', 'eth', 'key']
+CHUNK_SIZE = 1024 * 1024
+NAME_TABLE = np.frombuffer(NAME_CHARS.encode(), dtype=np.uint8)
+HEX_TABLE = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def decode_names(names):
+    # Vectorized name_to_string, one character column at a time
+    names = np.asarray(names, dtype=np.uint64)
+    chars = np.empty((len(names), 13), dtype=np.uint8)
+    for i in range(12):
+        chars[:, i] = NAME_TABLE[(names >> np.uint64(64 - 5 * (i + 1))) & np.uint64(0x1f)]
+    chars[:, 12] = NAME_TABLE[names & np.uint64(0x0f)]
+    return np.char.rstrip(chars.view('S13').ravel(), b'.').astype(str).tolist()
+
+
+def decode_eth_addresses(eth):
+    eth = np.asarray(eth, dtype=np.uint8)
+    chars = np.empty((len(eth), 2 + 2 * ETH_SIZE), dtype=np.uint8)
+    chars[:, 0], chars[:, 1] = ord('0'), ord('x')
+    chars[:, 2::2] = HEX_TABLE[eth >> 4]
+    chars[:, 3::2] = HEX_TABLE[eth & 0x0f]
+    return chars.view('S{}'.format(2 + 2 * ETH_SIZE)).ravel().astype(str).tolist()
+
+
+def is_snapshot_file(filename):
+    with open(filename, 'rb') as fin:
+        return fin.read(len(MAGIC)) == MAGIC
+
+
+class SnapshotWriter:
+    # Rows are appended to one temporary file per column, close() joins them
+    # under the header so memory use doesn't grow with the snapshot
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        self.columns = [open('{}.{}.tmp'.format(filename, column), 'wb') for column in COLUMNS]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def append(self, eth_address, account, key, units):
+        eth = bytes.fromhex(eth_address[2:] if eth_address.startswith('0x') else eth_address)
+        if len(eth) != ETH_SIZE:
+            raise SnapshotError('Invalid eth address {!r}'.format(eth_address))
+        balance, name, eth_column, key_column = self.columns
+        balance.write(struct.pack('<q', units))
+        name.write(struct.pack('<Q', string_to_name(account)))
+        eth_column.write(eth)
+        key_column.write(public_key_to_bytes(key))
+        self.count += 1
+
+    def close(self):
+        h = hashlib.sha256()
+        with open(self.filename + '.tmp', 'wb') as fout:
+            fout.write(b'\0' * HEADER_SIZE)
+            for column in self.columns:
+                column.close()
+                with open(column.name, 'rb') as fin:
+                    for block in iter(lambda: fin.read(CHUNK_SIZE), b''):
+                        h.update(block)
+                        fout.write(block)
+                os.remove(column.name)
+            fout.seek(0)
+            fout.write(HEADER.pack(MAGIC, VERSION, 0, self.count, h.digest()))
+        os.rename(self.filename + '.tmp', self.filename)
+
+    def discard(self):
+        for column in self.columns:
+            column.close()
+            os.remove(column.name)
+
+
+class Snapshot:
+    # Memory mapped snapshot, columns are decoded to strings only when asked for
+
+    def __init__(self, filename, verify=True):
+        self.filename = filename
+        with open(filename, 'rb') as fin:
+            magic, version, _, self.count, self.checksum = HEADER.unpack(fin.read(HEADER.size))
+        if magic != MAGIC:
+            raise SnapshotError('{} is not a snapshot file'.format(filename))
+        if version != VERSION:
+            raise SnapshotError('Unsupported snapshot version {}'.format(version))
+        if verify and self.compute_checksum() != self.checksum:
+            raise SnapshotError('Snapshot {} checksum failed'.format(filename))
+
+        offset = HEADER_SIZE
+        self.balances = self._map(offset, '<i8', (self.count,))
+        offset += 8 * self.count
+        self.names = self._map(offset, '<u8', (self.count,))
+        offset += 8 * self.count
+        self.eth = self._map(offset, np.uint8, (self.count, ETH_SIZE))
+        offset += ETH_SIZE * self.count
+        self.keys = self._map(offset, np.uint8, (self.count, KEY_SIZE))
+
+    def __len__(self):
+        return self.count
+
+    def _map(self, offset, dtype, shape):
+        if self.count == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    def compute_checksum(self):
+        h = hashlib.sha256()
+        with open(self.filename, 'rb') as fin:
+            fin.seek(HEADER_SIZE)
+            for block in iter(lambda: fin.read(CHUNK_SIZE), b''):
+                h.update(block)
+        return h.digest()
+
+    def accounts(self):
+        return decode_names(self.names)
+
+    def key_bytes(self):
+        data = self.keys.tobytes()
+        return [data[pos:pos + KEY_SIZE] for pos in range(0, len(data), KEY_SIZE)]
+
+    def key_strings(self):
+        # base58 is the slow part, accounts often share keys
+        cache = {}
+        keys = []
+        for key in self.key_bytes():
+            if key not in cache:
+                cache[key] = bytes_to_public_key(key)
+            keys.append(cache[key])
+        return keys
+
+    def eth_addresses(self):
+        return decode_eth_addresses(self.eth)
+
+    def to_frame(self):
+        # Same string columns the tools read from the CSV snapshot
+        return pandas.DataFrame({
+            'eth_address': self.eth_addresses(),
+            'eos_account': self.accounts(),
+            'eos_key': self.key_strings(),
+            'balance': format_amounts(self.balances)
+        }, dtype=str)
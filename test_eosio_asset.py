@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import pytest
+import pandas as pd
+from eosio_asset import to_units, parse_amounts, format_units, format_amounts
+
+AMOUNTS = ['12.3400', '12.34 TLOS', '12', '-1.5', ' 7.0001 EOS', '0.0001', '1.', '.5', '40000.0000']
+
+
+def test_parse_amounts_matches_to_units():
+    assert list(parse_amounts(AMOUNTS)) == [to_units(value) for value in AMOUNTS]
+    assert list(parse_amounts(pd.Series(AMOUNTS))) == [to_units(value) for value in AMOUNTS]
+
+
+@pytest.mark.parametrize('value', ['nan', '1e5', '1,000.0', '1.2.3', '1.23456', '', '.', '-', '--1', '1-2',
+                                   '- 12', 'abc', '9' * 19])
+def test_parse_amounts_rejects(value):
+    with pytest.raises(ValueError):
+        parse_amounts(['1.0000', value])
+
+
+@pytest.mark.parametrize('value', ['99999999999999', '99999999999999.9999', '100000000000000', '922337203685477',
+                                   '922337203685477.5807', '-922337203685477.5807 TLOS'])
+def test_parse_amounts_takes_14_and_15_integer_digits(value):
+    assert list(parse_amounts(['1.0000', value])) == [10000, to_units(value)]
+
+
+@pytest.mark.parametrize('value', ['922337203685477.5808', '922337203685478', '999999999999999', '1000000000000000',
+                                   '9999999999999999', '10000000000000000', '99999999999999999',
+                                   '100000000000000000', '999999999999999999', '-999999999999999999 TLOS'])
+def test_parse_amounts_rejects_overflow(value):
+    with pytest.raises(ValueError):
+        parse_amounts(['1.0000', value])
+
+
+def test_parse_amounts_rejects_missing_values():
+    with pytest.raises(ValueError):
+        parse_amounts(pd.Series(['1.0000', None]).astype(str))
+
+
+def test_format_amounts_matches_format_units():
+    units = [123400, -15000, 1, 0, 400000000]
+    assert list(format_amounts(units)) == [format_units(value) for value in units]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import zlib
+import struct
+import binascii
+from eosio_serializer import string_to_name, name_to_string, signature_to_string, base58_decode
+
+# A spool is a magic line followed by length prefixed records, each with the
+# crc32 of its payload and a type byte. The first record is a JSON header,
+# then one signed batch per transaction: the snapshot positions it starts and
+# ends at, the name of its last account, the compact signature and the packed
+# transaction. A JSON trailer with the transaction and account counts closes
+# it, a spool without one was never finished
+MAGIC = b'EOSSPL2\n'
+FRAME = struct.Struct('<II')
+BATCH = struct.Struct('<IIQ65s')
+HEADER_RECORD = b'H'
+BATCH_RECORD = b'B'
+TRAILER_RECORD = b'T'
+
+
+class SpoolError(Exception):
+    pass
+
+
+class SpoolWriter:
+    # Written under a temporary name, the spool only gets its own name once
+    # it is complete. Batches have to come in snapshot order without gaps
+
+    def __init__(self, filename, header):
+        self.filename = filename
+        self.file = open(filename + '.tmp', 'wb')
+        self.file.write(MAGIC)
+        self.count = 0
+        self.accounts = 0
+        self._write(HEADER_RECORD + json.dumps(header).encode())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _write(self, payload):
+        self.file.write(FRAME.pack(len(payload), zlib.crc32(payload)))
+        self.file.write(payload)
+
+    def write(self, start, end, last_account, trx):
+        # trx is the push_transaction body TransactionBuilder returns
+        if start != self.accounts:
+            raise SpoolError('Batch {} to {} does not follow account {}'.format(start, end, self.accounts))
+        signature = base58_decode(trx['signatures'][0][len('SIG_K1_'):])[:65]
+        self._write(BATCH_RECORD + BATCH.pack(start, end, string_to_name(last_account), signature) +
+                    binascii.unhexlify(trx['packed_trx']))
+        self.count += 1
+        self.accounts = end
+
+    def close(self):
+        self._write(TRAILER_RECORD + json.dumps({'transactions': self.count, 'accounts': self.accounts}).encode())
+        self.file.close()
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.filename + '.tmp')
+
+
+def _read_frames(fin, filename):
+    while True:
+        header = fin.read(FRAME.size)
+        if not header:
+            return
+        if len(header) < FRAME.size:
+            raise SpoolError('Truncated frame in {}'.format(filename))
+        size, checksum = FRAME.unpack(header)
+        payload = fin.read(size)
+        if len(payload) < size:
+            raise SpoolError('Truncated record in {}'.format(filename))
+        if zlib.crc32(payload) != checksum:
+            raise SpoolError('Checksum mismatch at offset {} of {}'.format(fin.tell() - size, filename))
+        yield payload[:1], payload[1:]
+
+
+def _open(filename):
+    fin = open(filename, 'rb')
+    if fin.read(len(MAGIC)) != MAGIC:
+        fin.close()
+        raise SpoolError('{} is not a transaction spool'.format(filename))
+    return fin
+
+
+def read_header(filename):
+    with _open(filename) as fin:
+        for kind, payload in _read_frames(fin, filename):
+            if kind != HEADER_RECORD:
+                break
+            return json.loads(payload)
+        raise SpoolError('{} has no header'.format(filename))
+
+
+def read_spool(filename):
+    # Yields (start, end, last account, push_transaction body). Raises once
+    # the batches turn out not to cover the header's accounts in order, or
+    # the trailer is missing or disagrees with them
+    with _open(filename) as fin:
+        frames = _read_frames(fin, filename)
+        kind, payload = next(frames, (None, None))
+        if kind != HEADER_RECORD:
+            raise SpoolError('{} has no header'.format(filename))
+        accounts = json.loads(payload)['accounts']
+        count = covered = 0
+        trailer = None
+        for kind, payload in frames:
+            if trailer is not None:
+                raise SpoolError('Records after the trailer of {}'.format(filename))
+            if kind == TRAILER_RECORD:
+                trailer = json.loads(payload)
+                continue
+            if kind != BATCH_RECORD:
+                raise SpoolError('Unknown record type {!r} in {}'.format(kind, filename))
+            start, end, last_account, signature = BATCH.unpack_from(payload)
+            if start != covered or end <= start:
+                raise SpoolError('Batch {} to {} of {} does not follow account {}'.format(
+                    start, end, filename, covered))
+            count += 1
+            covered = end
+            yield start, end, name_to_string(last_account), {
+                'signatures': [signature_to_string(signature)], 'compression': 'none',
+                'packed_context_free_data': '', 'packed_trx': binascii.hexlify(payload[BATCH.size:]).decode()}
+        if trailer is None:
+            raise SpoolError('{} has no trailer, it was not finished'.format(filename))
+        if trailer != {'transactions': count, 'accounts': covered} or covered != accounts:
+            raise SpoolError('{} has {} transactions for {} of {} accounts, its trailer says {}'.format(
+                filename, count, covered, accounts, trailer))
+
+
+def verify_spool(filename):
+    # Reads the whole spool once, returns the number of transactions
+    return sum(1 for _ in read_spool(filename))
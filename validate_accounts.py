@@ -5,15 +5,19 @@ import argparse
 import os
 import colorlog
 import inspect
-import eospy.cleos
+import asyncio
 import pandas as pd
 import numpy as np
 import pprint
 import csv
-import requests
-import re
 import traceback
-from multiprocessing import Pool
+import metrics
+from chain_client import ChainClient
+from chain_index import load_account_index, list_accounts
+from account_diff import DiffWriter, diff_accounts, EXTRA
+from fetch import FetchCache, FetchError
+from eosio_asset import to_units, parse_amounts
+from snapshot_format import Snapshot, is_snapshot_file
 
 SCRIPT_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
@@ -28,11 +32,24 @@ parser.add_argument("-d", '--debug', action="store_true",
 parser.add_argument('-l', '--log_file', default='{}.log'.format(
     os.path.basename(__file__).split('.')[0]), help='Log file')
 parser.add_argument('-s', '--snapshot_file',
-                    default='{}/eosmetal_telos_snapshot.csv'.format(SCRIPT_PATH), help='Snapshot file')
+                    default='{}/eosmetal_telos_snapshot.bin'.format(SCRIPT_PATH), help='Snapshot file (binary or csv)')
 parser.add_argument('-u', '--api_endpoint',
                     default='http://127.0.0.1:8888', help='EOSIO API endpoint URI')
-parser.add_argument('-t', '--num_threads', type=int,
-                    default=4, help='Number of threads to get account balances')
+parser.add_argument('-c', '--concurrency', type=int,
+                    default=64, help='Number of concurrent requests to the API endpoint')
+parser.add_argument('--cache_dir', default='{}/.cache'.format(SCRIPT_PATH),
+                    help='Download cache directory')
+parser.add_argument('--inputs_url', default='https://raw.githubusercontent.com/Telos-Foundation/snapshots/master/',
+                    help='Base URL of the account input files')
+parser.add_argument('--max_age', type=int, default=3600,
+                    help='Seconds a downloaded file is used before checking it for changes')
+parser.add_argument('-i', '--index_file',
+                    help='Validate against a chain_dumper index instead of the API endpoint')
+parser.add_argument('-o', '--diff_file', default='{}_diff.csv'.format(
+    os.path.basename(__file__).split('.')[0]), help='Mismatch report, csv or .jsonl')
+parser.add_argument('-t', '--balance_tolerance', default='0',
+                    help='Largest balance difference that still matches')
+metrics.add_arguments(parser)
 args = parser.parse_args()
 
 VERBOSE = args.verbose
@@ -40,7 +57,12 @@ DEBUG = args.debug
 SNAPSHOT_FILE = args.snapshot_file
 LOG_FILE = args.log_file
 API_ENDPOINT = args.api_endpoint
-NUM_THREADS = int(args.num_threads)
+CONCURRENCY = int(args.concurrency)
+INDEX_FILE = args.index_file
+CACHE_DIR = args.cache_dir
+MAX_AGE = args.max_age
+DIFF_FILE = args.diff_file
+BALANCE_TOLERANCE = to_units(args.balance_tolerance)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -65,38 +87,74 @@ TCRP_ACCOUNTS_FILE = 'tcrp_accounts.csv'
 TFRP_ACCOUNTS_FILE = 'tfrp_accounts.csv'
 TFVT_ACCOUNTS_FILE = 'tfvt_accounts.csv'
 SPECIAL_ACCOUNTS_FILE = 'special_accounts.csv'
+KEY_RECOVERY_FILE = 'key_recovery.csv'
+# Accounts each input file must have on chain. columns is the csv layout, a
+# header row is skipped, checks are what has to match: exists, key, balance
+CATEGORIES = [
+    {'name': 'bp', 'file': BP_ACCOUNTS_FILE,
+     'columns': ['a', 'b', 'eos_account', 'eos_key', 'balance', 'd'], 'checks': ['key']},
+    {'name': 'eos bp', 'file': EOS_BP_ACCOUNTS_FILE,
+     'columns': ['a', 'eos_account', 'eos_key', 'balance'], 'checks': ['key']},
+    {'name': 'ram', 'file': RAM_ACCOUNTS_FILE,
+     'columns': ['eth_address', 'unknown', 'eos_account', 'eos_key', 'balance'], 'checks': ['key']},
+    {'name': 'tcrp', 'file': TCRP_ACCOUNTS_FILE,
+     'columns': ['eos_account', 'eos_key', 'balance'], 'checks': ['key']},
+    {'name': 'tfrp', 'file': TFRP_ACCOUNTS_FILE,
+     'columns': ['eos_account', 'eos_key', 'balance'], 'checks': ['key', 'balance']},
+    {'name': 'tfvt', 'file': TFVT_ACCOUNTS_FILE,
+     'columns': ['a', 'b', 'eos_account', 'eos_key', 'balance'], 'checks': ['key']},
+    {'name': 'special', 'file': SPECIAL_ACCOUNTS_FILE,
+     'columns': ['eth_address', 'eos_account', 'eos_key', 'balance'], 'checks': ['exists']},
+    {'name': 'genesis', 'file': None, 'checks': ['key', 'balance']},
+]
+SNAPSHOTS_URL = args.inputs_url.rstrip('/') + '/'
+INPUT_URLS = {
+    BP_ACCOUNTS_FILE: SNAPSHOTS_URL + 'initial_block_producers.csv',
+    EOS_BP_ACCOUNTS_FILE: SNAPSHOTS_URL + 'eos_bp_accounts.csv',
+    RAM_ACCOUNTS_FILE: SNAPSHOTS_URL + 'ram_accounts.csv',
+    TCRP_ACCOUNTS_FILE: SNAPSHOTS_URL + 'tcrp_accounts.csv',
+    TFRP_ACCOUNTS_FILE: SNAPSHOTS_URL + 'tfrp_accounts.csv',
+    TFVT_ACCOUNTS_FILE: SNAPSHOTS_URL + 'tfvt_accounts.csv',
+    SPECIAL_ACCOUNTS_FILE: SNAPSHOTS_URL + 'telos_special_accounts.csv',
+    KEY_RECOVERY_FILE: SNAPSHOTS_URL + 'key_recovery.csv',
+}
 SCRIPT_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
-cleos = eospy.cleos.Cleos(url=API_ENDPOINT)
 
-def asset2float(asset):
-    return float(asset.split(' ')[0])
+def is_single_key_authority(auth):
+    return len(auth['keys']) == 1 and not auth['accounts'] and not auth.get('waits') and \
+        int(auth['threshold']) == 1 and int(auth['keys'][0]['weight']) == 1
 
-def get_account_info(account):
+@metrics.timed('get_account_info_seconds')
+async def get_account_info(client, account):
     try:
-        result = cleos.get_account(account)
+        result = await client.get_account(account)
         
         if not  'core_liquid_balance' in result:
             result['core_liquid_balance'] = "0"
-        balance = round(asset2float(result['core_liquid_balance']) + asset2float(result['total_resources']['cpu_weight']) + asset2float(result['total_resources']['net_weight']), 4)
+        balance = to_units(result['core_liquid_balance']) + to_units(result['total_resources']['cpu_weight']) + to_units(result['total_resources']['net_weight'])
         
         if len(result['permissions'][0]['required_auth']['accounts']) == 0:
             key = result['permissions'][0]['required_auth']['keys'][0]['key']
             if len(result['permissions']) > 2:
                 logger.critical('Account {} has more than 2 permissions'.format(account))
                 return '', 0
-            if result['permissions'][0]['required_auth']['keys'][0]['key'] != result['permissions'][0]['required_auth']['keys'][0]['key']:
+            if result['permissions'][0]['required_auth']['keys'][0]['key'] != result['permissions'][1]['required_auth']['keys'][0]['key']:
                 logger.critical('Owner and Active keys for account {} are different'.format(account))
                 return '', 0
             if len(result['permissions'][0]['required_auth']['keys']) > 1 or len(result['permissions'][1]['required_auth']['keys']) > 1 or len(result['permissions'][0]['required_auth']['accounts']) > 0 or len(result['permissions'][1]['required_auth']['accounts']) > 0:
                 logger.critical('Account {} has weird accounts or keys'.format(account))
                 return '', 0
+            if not all(is_single_key_authority(permission['required_auth']) for permission in result['permissions']):
+                logger.critical('Account {} has a threshold or key weight other than 1'.format(account))
+                return '', 0
         else:
             key = ''
 
     except Exception as e:
         if 'unknown key' in str(e):
             logger.critical('Account {} is not on chain'.format(account))
+            return None, 0
         else:
             logger.critical(e)
         return '', 0
@@ -104,331 +162,173 @@ def get_account_info(account):
     #logger.debug('{} {} {}'.format(account, key, balance))
     return key, balance
 
-def download_file(filename, url):
-    with open(filename, 'wb') as fout:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        # Write response data to file
-        for block in response.iter_content(4096):
-            fout.write(block)
+async def build_account_index(accounts):
+    # account -> (key, liquid, staked) in 1/10000 units. get_account is the only
+    # call that returns whole authorities, get_accounts_by_authorizers leaves
+    # out other keys, account authorities, waits and permissions of keys that
+    # weren't asked for, so it can't prove an account has just its one key.
+    # One get_account per account, which has the balances too
+    async with ChainClient(API_ENDPOINT, concurrency=CONCURRENCY) as client:
+        results = await asyncio.gather(*[get_account_info(client, account) for account in accounts])
+    return {account: (key, 0, balance) for account, (key, balance) in zip(accounts, results)}
+
+def fetch_inputs():
+    # All input files at once through the download cache, name -> cached path.
+    # Cached files are read in place and never modified
+    cache = FetchCache(CACHE_DIR, max_age=MAX_AGE)
+    paths = cache.fetch_all(list(INPUT_URLS.values()), workers=len(INPUT_URLS))
+    return dict(zip(INPUT_URLS, paths))
 
 def get_accounts(accounts):
-    i= 0
-    keys = []
-    balances = []    
-    
-    with Pool(NUM_THREADS) as p:
-        results = p.map(get_account_info, accounts)
+    # Chain state of every account, indexed by account. A None key means the
+    # account is not on chain, balances are liquid plus staked in 1/10000 units
+    if INDEX_FILE:
+        index = load_account_index(INDEX_FILE, accounts)
+    else:
+        index = asyncio.run(build_account_index(accounts))
+    results = [index[account] for account in accounts]
+    metrics.gauge('accounts_checked', len(results))
 
     return pd.DataFrame(
-    {'eos_account': accounts,
-     'eos_key': [x[0] for x in results],
-     'balance': ['{:.4f}'.format(x[1]) for x in results]
-    }, dtype=str)
+    {'eos_key': [x[0] for x in results],
+     'balance': np.array([x[1] + x[2] for x in results], dtype=np.int64),
+     'exists': [x[0] is not None for x in results]
+    }, index=pd.Index(accounts, name='eos_account'))
 
 def load_csv(file):
     with open(file, newline='') as csvfile:
         data = list(csv.reader(csvfile))
     return data
 
-def main():
-    #Check bp accounts
-    download_file(BP_ACCOUNTS_FILE,'https://raw.githubusercontent.com/Telos-Foundation/snapshots/master/initial_block_producers.csv')
-    logger.info('Loading bp_accounts...')
-    try:
-        with open(BP_ACCOUNTS_FILE, 'r') as fin:
-            data = fin.read().splitlines(True)
-        with open(BP_ACCOUNTS_FILE, 'w') as fout:
-            fout.writelines(data[1:])
-        
-        bp_accounts = pd.read_csv(BP_ACCOUNTS_FILE, dtype=str, names=['a', 'b', 'eos_account', 'eos_key', 'balance', 'd']).drop(columns=['a', 'b', 'd', 'balance']).sort_values(by=['eos_account'])
-
-        #Remove tabs
-        bp_accounts['eos_account'] = bp_accounts['eos_account'].apply(lambda x: re.sub(r"[\n\t\s]*", "", x))                                                                         
-        bp_accounts['eos_key'] = bp_accounts['eos_key'].apply(lambda x: re.sub(r"[\n\t\s]*", "", x))                  
-        #bp_accounts['balance'] = bp_accounts['balance'].apply(lambda x: '{:.4f}'.format(float(x)))                                                                 
-        bp_accounts = bp_accounts.reset_index(drop=True) 
-    except Exception as e:
-        logger.critical(
-            'Error loading bp accounts snapshot at {}: {}'.format(BP_ACCOUNTS_FILE, e))
-        exit(1)
-
-    logger.info('Getting bp accounts from chain...')
-    try:
-        chain_accounts = get_accounts(bp_accounts['eos_account'].tolist()).drop(columns=['balance']).sort_values(by=['eos_account'])
-    except Exception as e:
-        logger.critical('Error getting bp acounts from chain: {}'.format(e))
-        quit()
-    
-    logger.info('Checking bp accounts...')
-    if bp_accounts.equals(chain_accounts):
-        logger.info('All bp accounts are present on chain with the right key')
-    else:
-        ne_stacked = (bp_accounts != chain_accounts).stack()
-        changed = ne_stacked[ne_stacked]
-        difference_locations = np.where(bp_accounts != chain_accounts)
-        changed_from = bp_accounts.values[difference_locations]
-        changed_to = chain_accounts.values[difference_locations]
-        changes = pd.DataFrame({'from': changed_from, 'to': changed_to}, index=changed.index)
-        logger.critical('BP accounts in csv and chain don`t match')
-        print(changes)
-    
-    #Check eos bp accounts
-    download_file(EOS_BP_ACCOUNTS_FILE,'https://raw.githubusercontent.com/Telos-Foundation/snapshots/master/eos_bp_accounts.csv')
-    logger.info('Loading eos_bp_accounts...')
-    try:
-        with open(EOS_BP_ACCOUNTS_FILE, 'r') as fin:
-            data = fin.read().splitlines(True)
-        with open(EOS_BP_ACCOUNTS_FILE, 'w') as fout:
-            fout.writelines(data[1:])
-        
-        bp_accounts = pd.read_csv(EOS_BP_ACCOUNTS_FILE, dtype=str, names=['a', 'eos_account', 'eos_key', 'balance']).drop(columns=['a', 'balance']).sort_values(by=['eos_account'])
-
-        #Remove tabs
-        bp_accounts['eos_account'] = bp_accounts['eos_account'].apply(lambda x: re.sub(r"[\n\t\s]*", "", x))                                                                         
-        bp_accounts['eos_key'] = bp_accounts['eos_key'].apply(lambda x: re.sub(r"[\n\t\s]*", "", x))                  
-        #bp_accounts['balance'] = bp_accounts['balance'].apply(lambda x: '{:.4f}'.format(float(x)))                                                                 
-        bp_accounts = bp_accounts.reset_index(drop=True) 
-    except Exception as e:
-        logger.critical(
-            'Error loading bp accounts snapshot at {}: {}'.format(EOS_BP_ACCOUNTS_FILE, e))
-        exit(1)
-
-    logger.info('Getting eos bp accounts from chain...')
-    try:
-        chain_accounts = get_accounts(bp_accounts['eos_account'].tolist()).drop(columns=['balance']).sort_values(by=['eos_account'])
-    except Exception as e:
-        logger.critical('Error getting eos bp acounts from chain: {}'.format(e))
-        quit()
-    
-    logger.info('Checking eos bp accounts...')
-
-    if bp_accounts.equals(chain_accounts):
-        logger.info('All eos bp accounts are present on chain with the right key')
-    else:
-        ne_stacked = (bp_accounts != chain_accounts).stack()
-        changed = ne_stacked[ne_stacked]
-        difference_locations = np.where(bp_accounts != chain_accounts)
-        changed_from = bp_accounts.values[difference_locations]
-        changed_to = chain_accounts.values[difference_locations]
-        changes = pd.DataFrame({'from': changed_from, 'to': changed_to}, index=changed.index)
-        logger.critical('EOS BP accounts in csv and chain don`t match')
-        print(changes)
-    
-    #Check ram accounts
-    download_file(RAM_ACCOUNTS_FILE,'https://raw.githubusercontent.com/Telos-Foundation/snapshots/master/ram_accounts.csv')
-    logger.info('Loading ram_accounts...')
-    try:
-        ram_accounts = pd.read_csv(RAM_ACCOUNTS_FILE, dtype=str, names=['eth_address','unknown',
-                                                                         'eos_account', 'eos_key', 'balance']).drop(columns=['eth_address', 'balance']).drop(columns=['unknown']).sort_values(by=['eos_account'])
-        ram_accounts = ram_accounts.drop(0)
-        #ram_accounts['balance'] = ram_accounts['balance'].apply(lambda x: '{:.4f}'.format(float(x)))           
-        ram_accounts = ram_accounts.reset_index(drop=True) 
-    except Exception as e:
-        logger.critical(
-            'Error loading ram accounts snapshot at {}: {}'.format(TCRP_ACCOUNTS_FILE, e))
-        exit(1)
-
-    logger.info('Getting ram accounts from chain...')
-    try:
-        chain_accounts = get_accounts(ram_accounts['eos_account'].tolist()).drop(columns=['balance']).sort_values(by=['eos_account'])
-    except Exception as e:
-        logger.critical('Error getting ram acounts from chain: {}'.format(e))
-    
-    logger.info('Checking ram accounts...')
-    if ram_accounts.equals(chain_accounts):
-        logger.info('All ram accounts are present on chain with the right key')
-    else:
-        ne_stacked = (ram_accounts != chain_accounts).stack()
-        changed = ne_stacked[ne_stacked]
-        difference_locations = np.where(ram_accounts != chain_accounts)
-        changed_from = ram_accounts.values[difference_locations]
-        changed_to = chain_accounts.values[difference_locations]
-        changes = pd.DataFrame({'from': changed_from, 'to': changed_to}, index=changed.index)
-        logger.critical('ram accounts in csv and chain don`t match')
-        print(changes)
-    
-    #Check tcrp accounts
-    download_file(TCRP_ACCOUNTS_FILE,'https://raw.githubusercontent.com/Telos-Foundation/snapshots/master/tcrp_accounts.csv')
-    logger.info('Loading tcrp_accounts...')
-    try:
-        tcrp_accounts = pd.read_csv(TCRP_ACCOUNTS_FILE, dtype=str, names=[
-                                                                         'eos_account', 'eos_key', 'balance']).drop(columns=['balance']).sort_values(by=['eos_account'])
-        tcrp_accounts = tcrp_accounts.drop(0)
-        #tcrp_accounts['balance'] = tcrp_accounts['balance'].apply(lambda x: '{:.4f}'.format(float(x)))           
-        tcrp_accounts = tcrp_accounts.reset_index(drop=True) 
-    except Exception as e:
-        logger.critical(
-            'Error loading tcrp accounts snapshot at {}: {}'.format(TCRP_ACCOUNTS_FILE, e))
-        exit(1)
-
-    logger.info('Getting tcrp accounts from chain...')
-    try:
-        chain_accounts = get_accounts(tcrp_accounts['eos_account'].tolist()).drop(columns=['balance']).sort_values(by=['eos_account'])
-    except Exception as e:
-        logger.critical('Error getting tcrp acounts from chain: {}'.format(e))
-    
-    logger.info('Checking tcrp accounts...')
-    if tcrp_accounts.equals(chain_accounts):
-        logger.info('All tcrp accounts are present on chain with the right key')
-    else:
-        ne_stacked = (tcrp_accounts != chain_accounts).stack()
-        changed = ne_stacked[ne_stacked]
-        difference_locations = np.where(tcrp_accounts != chain_accounts)
-        changed_from = tcrp_accounts.values[difference_locations]
-        changed_to = chain_accounts.values[difference_locations]
-        changes = pd.DataFrame({'from': changed_from, 'to': changed_to}, index=changed.index)
-        logger.critical('tcrp accounts in csv and chain don`t match')
-        print(changes)
-    
-    #Check tfrp accounts
-    download_file(TFRP_ACCOUNTS_FILE,'https://raw.githubusercontent.com/Telos-Foundation/snapshots/master/tfrp_accounts.csv')
-    logger.info('Loading tfrp_accounts...')
-    with open(TFRP_ACCOUNTS_FILE, 'r') as fin:
-        data = fin.read().splitlines(True)
-    with open(TFRP_ACCOUNTS_FILE, 'w') as fout:
-        fout.writelines(data[1:])
-    try:
-        tfrp_accounts = pd.read_csv(TFRP_ACCOUNTS_FILE, dtype=str, names=[
-                                                                         'eos_account', 'eos_key', 'balance']).sort_values(by=['eos_account'])
-        #tfrp_accounts = tfrp_accounts.drop(0)
-        tfrp_accounts['balance'] = tfrp_accounts['balance'].apply(lambda x: '{:.4f}'.format(float(x)))           
-        tfrp_accounts = tfrp_accounts.reset_index(drop=True) 
-    except Exception as e:
-        logger.critical(
-            'Error loading tfrp accounts snapshot at {}: {}'.format(TFRP_ACCOUNTS_FILE, e))
-        exit(1)
-
-    logger.info('Getting tfrp accounts from chain...')
-    try:
-        chain_accounts = get_accounts(tfrp_accounts['eos_account'].tolist()).sort_values(by=['eos_account'])
-    except Exception as e:
-        logger.critical('Error getting tfrp acounts from chain: {}'.format(e))
-    
-    logger.info('Checking tfrp accounts...')
-    if tfrp_accounts.equals(chain_accounts):
-        logger.info('All tfrp accounts are present on chain with the right key')
-    else:
-        ne_stacked = (tfrp_accounts != chain_accounts).stack()
-        changed = ne_stacked[ne_stacked]
-        difference_locations = np.where(tfrp_accounts != chain_accounts)
-        changed_from = tfrp_accounts.values[difference_locations]
-        changed_to = chain_accounts.values[difference_locations]
-        changes = pd.DataFrame({'from': changed_from, 'to': changed_to}, index=changed.index)
-        logger.critical('tfrp accounts in csv and chain don`t match')
-        print(changes)
-
-    #Check tfvt accounts
-    download_file(TFVT_ACCOUNTS_FILE,'https://raw.githubusercontent.com/Telos-Foundation/snapshots/master/tfvt_accounts.csv')
-    logger.info('Loading tfvt_accounts...')
-    try:
-        tfvt_accounts = pd.read_csv(TFVT_ACCOUNTS_FILE, dtype=str, names=['a', 'b',
-                                                                         'eos_account', 'eos_key', 'balance']).drop(columns=['a', 'b', 'balance']).sort_values(by=['eos_account'])
-        tfvt_accounts = tfvt_accounts.drop(0)
-        #tfvt_accounts['balance'] = tfvt_accounts['balance'].apply(lambda x: '{:.4f}'.format(float(x)))           
-        tfvt_accounts = tfvt_accounts.reset_index(drop=True) 
-    except Exception as e:
-        logger.critical(
-            'Error loading tfvt accounts snapshot at {}: {}'.format(TFVT_ACCOUNTS_FILE, e))
-        exit(1)
+def load_snapshot(filename):
+    if is_snapshot_file(filename):
+        return Snapshot(filename).to_frame()
+    return pd.read_csv(filename, dtype=str, names=['eth_address', 'eos_account', 'eos_key', 'balance'])
+
+def merge_key_recovery(telos_genesis, key_recovery):
+    recovery = pd.DataFrame([row[:2] for row in key_recovery if len(row) >= 2],
+                            columns=['eth_address', 'eos_key'], dtype=str)
+    recovery['eth_address'] = recovery['eth_address'].str.lower()
+
+    # Later entries win, as they did when rows were applied one by one
+    duplicated = recovery['eth_address'].duplicated(keep='last')
+    if duplicated.any():
+        logger.warning('{} duplicated key recovery entries: {}'.format(
+            duplicated.sum(), ', '.join(recovery.loc[duplicated, 'eth_address'].unique())))
+    recovery = recovery[~duplicated].set_index('eth_address')['eos_key']
+
+    unmatched = ~recovery.index.isin(telos_genesis['eth_address'])
+    if unmatched.any():
+        logger.warning('{} key recovery entries not in snapshot: {}'.format(
+            unmatched.sum(), ', '.join(recovery.index[unmatched])))
+
+    recovered = telos_genesis['eth_address'].map(recovery)
+    mask = recovered.notna()
+    telos_genesis.loc[mask, 'eos_key'] = recovered[mask]
+    logger.info('Recovered keys for {} accounts'.format(mask.sum()))
+    return telos_genesis
+
+def load_category(category, inputs):
+    # eos_account, eos_key and balance in 1/10000 units, whitespace removed
+    frame = pd.read_csv(inputs[category['file']], dtype=str, skiprows=1, names=category['columns'],
+                        keep_default_na=False)
+    frame = frame[['eos_account', 'eos_key', 'balance']]
+    for column in ['eos_account', 'eos_key']:
+        frame[column] = frame[column].str.replace(r'\s', '', regex=True)
+    frame['balance'] = parse_amounts(frame['balance']) if 'balance' in category['checks'] else 0
+    return frame
+
+def load_genesis(inputs):
+    telos_genesis = load_snapshot(SNAPSHOT_FILE)
+    logger.info('Merging key recovery...')
+    telos_genesis = merge_key_recovery(telos_genesis, load_csv(inputs[KEY_RECOVERY_FILE]))
+    telos_genesis = telos_genesis[['eos_account', 'eos_key', 'balance']].copy()
+    telos_genesis['balance'] = parse_amounts(telos_genesis['balance'])
+    return telos_genesis
+
+def load_expected(inputs):
+    # Every category in one frame, one row per account and category
+    frames = []
+    for category in CATEGORIES:
+        logger.info('Loading {} accounts...'.format(category['name']))
+        try:
+            if category['file'] is None:
+                frame = load_genesis(inputs)
+            else:
+                frame = load_category(category, inputs)
+        except Exception as e:
+            logger.critical('Error loading {} accounts from {}: {}'.format(
+                category['name'], category['file'] or SNAPSHOT_FILE, e))
+            exit(1)
+        frame['category'] = category['name']
+        for check in ['exists', 'key', 'balance']:
+            frame['check_' + check] = check in category['checks']
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+def report(writer):
+    failed = False
+    for category in CATEGORIES:
+        name = category['name']
+        counts = writer.summary(name)
+        errors = sum(counts.values())
+        if errors == 0:
+            logger.info('All {} {} accounts are present on chain{}'.format(
+                writer.totals.get(name, 0), name,
+                ' with the right ' + ' and '.join(c for c in category['checks'] if c != 'exists')
+                if category['checks'] != ['exists'] else ''))
+            continue
+        failed = True
+        logger.critical('{} of {} {} accounts in csv and chain don`t match: {}'.format(
+            errors, writer.totals.get(name, 0), name,
+            ', '.join('{} {}'.format(count, status) for status, count in counts.items() if count)))
+        for row in writer.first.get(name, []):
+            logger.critical('{eos_account} {status}: key {eos_key} chain {chain_key}, '
+                            'balance {balance} chain {chain_balance}'.format(**row))
+
+    extra = writer.summary('chain')[EXTRA]
+    if extra:
+        logger.warning('{} accounts on chain are in no category'.format(extra))
+    logger.info('Mismatches written to {}'.format(writer.filename))
+    return not failed
 
-    logger.info('Getting tfvt accounts from chain...')
-    try:
-        chain_accounts = get_accounts(tfvt_accounts['eos_account'].tolist()).drop(columns=['balance']).sort_values(by=['eos_account'])
-    except Exception as e:
-        logger.critical('Error getting tfvt acounts from chain: {}'.format(e))
-    
-    logger.info('Checking tfvt accounts...')
-    if tfvt_accounts.equals(chain_accounts):
-        logger.info('All tfvt accounts are present on chain with the right key')
-    else:
-        ne_stacked = (tfvt_accounts != chain_accounts).stack()
-        changed = ne_stacked[ne_stacked]
-        difference_locations = np.where(tfvt_accounts != chain_accounts)
-        changed_from = tfvt_accounts.values[difference_locations]
-        changed_to = chain_accounts.values[difference_locations]
-        changes = pd.DataFrame({'from': changed_from, 'to': changed_to}, index=changed.index)
-        logger.critical('tfvt accounts in csv and chain don`t match')
-        print(changes)
-
-    #Check special accounts
-    download_file(SPECIAL_ACCOUNTS_FILE,'https://raw.githubusercontent.com/Telos-Foundation/snapshots/master/telos_special_accounts.csv')
-    logger.info('Loading special_accounts...')
+def main():
+    logger.info('Getting input files...')
     try:
-        special_accounts = pd.read_csv(SPECIAL_ACCOUNTS_FILE, dtype=str, names=['eth_address',
-                                                                         'eos_account', 'eos_key', 'balance']).drop(columns=['eth_address']).drop(columns=['eos_key']).drop(columns=['balance']).sort_values(by=['eos_account'])
-        special_accounts = special_accounts.drop(0)
-        #special_accounts['balance'] = special_accounts['balance'].apply(lambda x: '{:.4f}'.format(float(x)))           
-        special_accounts = special_accounts.reset_index(drop=True) 
-    except Exception as e:
-        logger.critical(
-            'Error loading special accounts snapshot at {}: {}'.format(SPECIAL_ACCOUNTS_FILE, e))
+        inputs = fetch_inputs()
+    except FetchError as e:
+        logger.critical('Error getting input files: {}'.format(e))
         exit(1)
 
-    logger.info('Getting special accounts from chain...')
-    try:
-        chain_accounts = get_accounts(special_accounts['eos_account'].tolist()).sort_values(by=['eos_account']).drop(columns=['eos_key']).drop(columns=['balance'])
-    except Exception as e:
-        logger.critical('Error getting tcrp acounts from chain: {}'.format(e))
-    
-    logger.info('Checking special accounts...')
-    if special_accounts.equals(chain_accounts):
-        logger.info('All special accounts are present on chain') #with the right key and balance')
-    else:
-        ne_stacked = (special_accounts != chain_accounts).stack()
-        changed = ne_stacked[ne_stacked]
-        difference_locations = np.where(special_accounts != chain_accounts)
-        changed_from = special_accounts.values[difference_locations]
-        changed_to = chain_accounts.values[difference_locations]
-        changes = pd.DataFrame({'from': changed_from, 'to': changed_to}, index=changed.index)
-        logger.critical('special accounts in csv and chain don`t match')
-        print(changes)
-
-    #Check genesis accounts
-    download_file('key_recovery.csv','https://raw.githubusercontent.com/Telos-Foundation/snapshots/master/key_recovery.csv')
-    key_recovery = load_csv('key_recovery.csv')
-
-    logger.info('Loading snapshot...')
-    try:
-        telos_genesis = pd.read_csv(SNAPSHOT_FILE, dtype=str, names=['eth_address',
-                                                                         'eos_account', 'eos_key', 'balance']).sort_values(by=['eos_account'])
-        
-        logger.info('Merging key recovery...')
-        for row in key_recovery:
-            telos_genesis.loc[telos_genesis['eth_address'] == row[0].lower(), ['eos_key']] = row[1]
-
-        telos_genesis =telos_genesis.drop(columns=['eth_address'])
-        telos_genesis = telos_genesis.reset_index(drop=True)                                                                        
-    except Exception as e:
-        logger.critical(
-            'Error loading snapshot at {}: {}'.format(SNAPSHOT_FILE, e))
-        exit(1)
+    with metrics.timer('stage_seconds', stage='load'):
+        expected = load_expected(inputs)
 
-    logger.info('Getting accounts from chain...')
+    # Each account is fetched once, whichever categories it is in
+    accounts = expected['eos_account'].unique().tolist()
+    if INDEX_FILE:
+        # The index knows every account, so the ones no category expects show up too
+        accounts = list(dict.fromkeys(accounts + list_accounts(INDEX_FILE)))
+    logger.info('Getting {} accounts from chain, one get_account each...'.format(len(accounts)))
     try:
-        chain_accounts = get_accounts(telos_genesis['eos_account'].tolist()).sort_values(by=['eos_account'])
+        with metrics.timer('stage_seconds', stage='chain'):
+            chain = get_accounts(accounts)
     except Exception as e:
         logger.critical('Error getting acounts from chain: {}'.format(e))
-        quit()
+        exit(1)
 
     if DEBUG:
-        telos_genesis.to_csv('debug-genesis.csv', header=False)
-        chain_accounts.to_csv('debug-chain.csv', header=False)
+        expected.to_csv('debug-expected.csv', header=False)
+        chain.to_csv('debug-chain.csv', header=False)
 
     logger.info('Checking accounts...')
-    if telos_genesis.equals(chain_accounts):
-        logger.info('All accounts in snapshot are present on chain with the right key and balance')
-    else:
-        ne_stacked = (telos_genesis != chain_accounts).stack()
-        changed = ne_stacked[ne_stacked]
-        difference_locations = np.where(telos_genesis != chain_accounts)
-        changed_from = telos_genesis.values[difference_locations]
-        changed_to = chain_accounts.values[difference_locations]
-        changes = pd.DataFrame({'from': changed_from, 'to': changed_to}, index=changed.index)
-        logger.critical('Accounts in genesis and chain don`t match')
-        print(changes)
-        quit()
+    with DiffWriter(DIFF_FILE) as writer, metrics.timer('stage_seconds', stage='diff'):
+        diff_accounts(expected, chain, writer, tolerance=BALANCE_TOLERANCE)
+    for (category, status), count in writer.counts.items():
+        metrics.gauge('mismatches', count, category=category, status=status)
+    if not report(writer):
+        logger.critical('Validation failed')
+        exit(1)
 
     logger.info('Validation finished')
 if __name__ == "__main__":
-    main()
+    metrics.run(main, args)
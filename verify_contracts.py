@@ -6,7 +6,13 @@ import os
 import colorlog
 import inspect
 import hashlib
-from eospy.cleos import Cleos
+import json
+import base64
+import asyncio
+import pandas as pd
+import metrics
+from chain_client import ChainClient
+from eosio_serializer import decode_abi, canonical_abi
 
 SCRIPT_PATH = os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe())))
@@ -18,17 +24,34 @@ parser.add_argument("-d", '--debug', action="store_true",
                     dest="debug", help='Print debug info')
 parser.add_argument('-l', '--log_file', default='{}.log'.format(
     os.path.basename(__file__).split('.')[0]), help='Log file')
-parser.add_argument('-u', '--api_endpoint',
-                    default='http://127.0.0.1:8888', help='EOSIO API endpoint URI')
+parser.add_argument('-u', '--api_endpoint', nargs='+',
+                    default=['http://127.0.0.1:8888'], help='EOSIO API endpoint URIs')
 parser.add_argument('-c', '--contracts_path',
                     default='/opt/telos-launch/source/telos/build/contracts/', help='Path of the compiled contracts')
+parser.add_argument('-e', '--endpoints_file',
+                    help='File with more API endpoint URIs, one per line')
+parser.add_argument('-m', '--manifest',
+                    help='JSON list of contracts to verify, each with account and contract, optionally wasm and abi paths')
+parser.add_argument('-f', '--full', action="store_true",
+                    help='Compare code and ABI fetched with get_raw_code_and_abi')
+parser.add_argument('--hash_cache',
+                    default='{}/.{}.cache'.format(SCRIPT_PATH, os.path.basename(__file__).split('.')[0]),
+                    help='File caching the hashes of the compiled contracts')
+parser.add_argument('--concurrency', type=int,
+                    default=16, help='Number of concurrent requests to each API endpoint')
 
+metrics.add_arguments(parser)
 args = parser.parse_args()
 VERBOSE = args.verbose
 DEBUG = args.debug
 LOG_FILE = args.log_file
-API_ENDPOINT = args.api_endpoint
+API_ENDPOINTS = args.api_endpoint
 CONTRACTS_PATH = args.contracts_path
+ENDPOINTS_FILE = args.endpoints_file
+MANIFEST = args.manifest
+FULL = args.full
+HASH_CACHE = args.hash_cache
+CONCURRENCY = args.concurrency
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -63,7 +86,6 @@ CONTRACTS = [
   }
 ]
 
-cleos = Cleos(url=API_ENDPOINT)
 def sha256sum(filename):
     h = hashlib.sha256()
     with open(filename, 'rb', buffering=0) as f:
@@ -71,19 +93,125 @@ def sha256sum(filename):
             h.update(b)
     return h.hexdigest()
 
-def main():
-  for contract in CONTRACTS:
+def load_hash_cache(filename):
     try:
-      chain_hash = cleos.get_code(contract['account'])['code_hash']
-      contract_hash = sha256sum('{}{}/{}.wasm'.format(CONTRACTS_PATH, contract['contract'], contract['contract']))
-    
-      if chain_hash == contract_hash:
-        logger.info('Contract {} for account {} matches'.format(contract['contract'], contract['account']))
-      else:
-        logger.critical('Contract {} for account {} doesn\'t match'.format(contract['contract'], contract['account']))
+        with open(filename) as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return {}
+
+def save_hash_cache(filename, cache):
+    with open(filename + '.tmp', 'w') as fout:
+        json.dump(cache, fout, indent=2, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+def canonical_abi_hash(filename):
+    with open(filename) as fin:
+        return hashlib.sha256(canonical_abi(json.load(fin))).hexdigest()
+
+def cached_hash(filename, cache, hash_file=sha256sum):
+    # Files are only hashed again when their size or mtime changes
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    entry = cache.get(path)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return entry['sha256']
+    digest = hash_file(path)
+    cache[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest}
+    return digest
+
+def load_contracts():
+    contracts = CONTRACTS
+    if MANIFEST:
+        with open(MANIFEST) as fin:
+            contracts = json.load(fin)
+    for contract in contracts:
+        contract.setdefault('wasm', '{}{}/{}.wasm'.format(CONTRACTS_PATH, contract['contract'], contract['contract']))
+        contract.setdefault('abi', '{}{}/{}.abi'.format(CONTRACTS_PATH, contract['contract'], contract['contract']))
+    return contracts
+
+def load_endpoints():
+    endpoints = list(API_ENDPOINTS)
+    if ENDPOINTS_FILE:
+        with open(ENDPOINTS_FILE) as fin:
+            endpoints += [line.strip() for line in fin if line.strip() and not line.startswith('#')]
+    return list(dict.fromkeys(endpoints))
+
+def get_local_hashes(contracts):
+    # (wasm hash, abi hash) per contract, an exception in place of a hash
+    # when the file can't be read
+    cache = load_hash_cache(HASH_CACHE)
+    hashes = {}
+    for contract in contracts:
+        local = []
+        for filename, hash_file, needed in [(contract['wasm'], sha256sum, True),
+                                            (contract['abi'], canonical_abi_hash, FULL)]:
+            try:
+                local.append(cached_hash(filename, cache, hash_file) if needed else None)
+            except (OSError, ValueError) as e:
+                local.append(e)
+        hashes[contract['account']] = tuple(local)
+    save_hash_cache(HASH_CACHE, cache)
+    return hashes
+
+async def get_chain_hashes(client, account):
+    if not FULL:
+        return (await client.get_code(account))['code_hash'], None
+    result = await client.get_raw_code_and_abi(account)
+    wasm = base64.b64decode(result['wasm'])
+    abi = base64.b64decode(result['abi'])
+    return hashlib.sha256(wasm).hexdigest(), hashlib.sha256(canonical_abi(decode_abi(abi))).hexdigest()
+
+async def check_contract(client, contract, local_hashes):
+    # Returns the status, the matrix cell and the details to log
+    errors = [str(h) for h in local_hashes if isinstance(h, Exception)]
+    if errors:
+        return 'error', 'error', 'Local contract: {}'.format(', '.join(errors))
+    try:
+        chain_hashes = await get_chain_hashes(client, contract['account'])
     except Exception as e:
-      logger.critical('Error checking contract: {}'.format(e))
-      quit()
+        return 'error', 'error', str(e)
+    mismatches = [(part, chain_hash, local_hash)
+                  for part, chain_hash, local_hash in zip(['code', 'abi'], chain_hashes, local_hashes)
+                  if chain_hash != local_hash]
+    if not mismatches:
+        return 'pass', 'ok', chain_hashes[0]
+    return ('fail', '+'.join(part for part, _, _ in mismatches),
+            ', '.join('{} chain {} local {}'.format(*mismatch) for mismatch in mismatches))
+
+async def check_endpoint(endpoint, contracts, hashes):
+    async with ChainClient(endpoint, concurrency=CONCURRENCY) as client:
+        return await asyncio.gather(*[check_contract(client, contract, hashes[contract['account']])
+                                      for contract in contracts])
+
+async def verify(endpoints, contracts, hashes):
+    results = await asyncio.gather(*[check_endpoint(endpoint, contracts, hashes) for endpoint in endpoints])
+    return dict(zip(endpoints, results))
+
+def main():
+  contracts = load_contracts()
+  endpoints = load_endpoints()
+  hashes = get_local_hashes(contracts)
+  results = asyncio.run(verify(endpoints, contracts, hashes))
+
+  counts = {'pass': 0, 'fail': 0, 'error': 0}
+  matrix = {}
+  for endpoint, endpoint_results in results.items():
+    row = matrix[endpoint] = {}
+    for contract, (status, cell, detail) in zip(contracts, endpoint_results):
+      counts[status] += 1
+      row['{}@{}'.format(contract['contract'], contract['account'])] = cell
+      if status == 'pass':
+        logger.info('{} contract {} for account {} matches'.format(endpoint, contract['contract'], contract['account']))
+      elif status == 'fail':
+        logger.critical('{} contract {} for account {} doesn\'t match: {}'.format(endpoint, contract['contract'], contract['account'], detail))
+      else:
+        logger.critical('{} error checking contract {} for account {}: {}'.format(endpoint, contract['contract'], contract['account'], detail))
+
+  print(pd.DataFrame.from_dict(matrix, orient='index').to_string())
+  logger.info('{pass} passed, {fail} failed, {error} errors'.format(**counts))
+  if counts['fail'] or counts['error']:
+    exit(1)
 
 if __name__ == "__main__":
-    main()
+    metrics.run(main, args)
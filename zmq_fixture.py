@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import struct
+import logging
+import argparse
+import colorlog
+import zmq
+
+# A recording is a magic line followed by one frame per message: the seconds
+# since the first message as a double, the message length and the message
+MAGIC = b'ZMQREC1\n'
+FRAME = struct.Struct('<dI')
+MSG_HEADER = struct.Struct('<ii')
+MSGTYPE_ACTION_TRACE = 0
+MSGTYPE_IRREVERSIBLE_BLOCK = 1
+POLL_TIMEOUT_MS = 100
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingError(Exception):
+    pass
+
+
+class RecordingWriter:
+
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+        self.count = 0
+        self.start = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if self.start is None:
+            self.start = timestamp
+        self.file.write(FRAME.pack(timestamp - self.start, len(data)))
+        self.file.write(data)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(filename):
+    # Yields (seconds since the first message, message)
+    with open(filename, 'rb') as fin:
+        if fin.read(len(MAGIC)) != MAGIC:
+            raise RecordingError('{} is not a ZMQ recording'.format(filename))
+        while True:
+            header = fin.read(FRAME.size)
+            if not header:
+                return
+            if len(header) < FRAME.size:
+                raise RecordingError('Truncated frame in {}'.format(filename))
+            offset, size = FRAME.unpack(header)
+            data = fin.read(size)
+            if len(data) < size:
+                raise RecordingError('Truncated message in {}'.format(filename))
+            yield offset, data
+
+
+def record(endpoint, filename, count=0, duration=0, hwm=100000, stop=lambda: False):
+    # Captures what a zmq_plugin PUSH socket sends, until count messages,
+    # duration seconds or stop() returns true. Returns the number recorded
+    context = zmq.Context()
+    socket = context.socket(zmq.PULL)
+    socket.setsockopt(zmq.RCVHWM, hwm)
+    socket.connect(endpoint)
+    deadline = time.monotonic() + duration if duration else None
+    try:
+        with RecordingWriter(filename) as writer:
+            while not stop() and not (count and writer.count >= count):
+                if deadline and time.monotonic() >= deadline:
+                    break
+                if socket.poll(POLL_TIMEOUT_MS):
+                    writer.write(socket.recv())
+            return writer.count
+    finally:
+        socket.close(linger=0)
+        context.term()
+
+
+def replay(messages, socket, rate=0, speed=0, stop=lambda: False):
+    # Sends (offset, message) pairs to a PUSH socket, at full speed, at rate
+    # messages per second, or speed times as fast as they were recorded.
+    # Returns the number sent and the seconds it took
+    start = time.perf_counter()
+    sent = 0
+    for offset, data in messages:
+        if stop():
+            break
+        if rate:
+            delay = start + sent / rate - time.perf_counter()
+        elif speed:
+            delay = start + offset / speed - time.perf_counter()
+        else:
+            delay = 0
+        if delay > 0:
+            time.sleep(delay)
+        socket.send(data)
+        sent += 1
+    return sent, time.perf_counter() - start
+
+
+def action_trace(block_num, code, action, data, actor='eosio'):
+    trace = {'block_num': block_num, 'receipt': {'receiver': code},
+             'act': {'account': code, 'name': action, 'data': data,
+                     'authorization': [{'actor': actor, 'permission': 'active'}]}}
+    return MSG_HEADER.pack(MSGTYPE_ACTION_TRACE, 0) + json.dumps({'action_trace': trace}).encode()
+
+
+def irreversible_block(block_num):
+    return MSG_HEADER.pack(MSGTYPE_IRREVERSIBLE_BLOCK, 0) + json.dumps({'irreversible_block_num': block_num}).encode()
+
+
+def genesis_messages(accounts, keys, per_block=100, start_block=2):
+    # The traces an account injection produces, newaccount, buyrambytes,
+    # delegatebw and transfer per account, each block followed by its
+    # irreversible notice. Yields (block_num, message)
+    block_num = start_block
+    for pos in range(0, len(accounts), per_block):
+        for account, key in zip(accounts[pos:pos + per_block], keys[pos:pos + per_block]):
+            auth = {'threshold': 1, 'keys': [{'key': key, 'weight': 1}], 'accounts': [], 'waits': []}
+            yield block_num, action_trace(block_num, 'eosio', 'newaccount',
+                                          {'creator': 'eosio', 'name': account, 'owner': auth, 'active': auth})
+            yield block_num, action_trace(block_num, 'eosio', 'buyrambytes',
+                                          {'payer': 'eosio', 'receiver': account, 'bytes': 4096})
+            yield block_num, action_trace(block_num, 'eosio', 'delegatebw',
+                                          {'from': 'eosio', 'receiver': account, 'stake_net_quantity': '0.5000 TLOS',
+                                           'stake_cpu_quantity': '0.5000 TLOS', 'transfer': True})
+            yield block_num, action_trace(block_num, 'eosio.token', 'transfer',
+                                          {'from': 'eosio', 'to': account, 'quantity': '1.0000 TLOS',
+                                           'memo': 'transfer genesis balance to {}'.format(account)})
+        yield block_num, irreversible_block(block_num)
+        block_num += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record a zmq_plugin stream or replay a recording')
+    parser.add_argument("-v", '--verbose', action="store_true",
+                        dest="verbose", help='Print logged info to screen')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_parser = commands.add_parser('record', help='Record the messages a nodeos zmq_plugin sends')
+    record_parser.add_argument('-z', '--zmq_socket', default='tcp://127.0.0.1:5556',
+                               help='ZMQ socket of the zmq_plugin')
+    record_parser.add_argument('-o', '--output', required=True, help='Recording file')
+    record_parser.add_argument('-n', '--count', type=int, default=0, help='Messages to record, 0 for no limit')
+    record_parser.add_argument('-t', '--duration', type=float, default=0, help='Seconds to record, 0 for no limit')
+    replay_parser = commands.add_parser('replay', help='Send a recording from a PUSH socket')
+    replay_parser.add_argument('-i', '--input', required=True, help='Recording file')
+    replay_parser.add_argument('-z', '--zmq_socket', default='tcp://127.0.0.1:5556',
+                               help='ZMQ socket to bind, where chain_dumper connects')
+    replay_parser.add_argument('-r', '--rate', type=float, default=0,
+                               help='Messages per second, 0 for full speed')
+    replay_parser.add_argument('-s', '--speed', type=float, default=0,
+                               help='Replay the recorded timing this many times faster')
+    replay_parser.add_argument('--loop', type=int, default=1, help='Times to send the recording')
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    ch.setFormatter(colorlog.ColoredFormatter(
+        '%(log_color)s%(asctime)s - %(levelname)s - %(message)s%(reset)s'))
+    logger.addHandler(ch)
+    try:
+        if args.command == 'record':
+            logger.info('Recording {} to {}'.format(args.zmq_socket, args.output))
+            count = record(args.zmq_socket, args.output, args.count, args.duration)
+            logger.info('{} messages recorded'.format(count))
+            return
+
+        context = zmq.Context()
+        socket = context.socket(zmq.PUSH)
+        socket.bind(args.zmq_socket)
+        for _ in range(args.loop):
+            sent, seconds = replay(read_recording(args.input), socket, args.rate, args.speed)
+            logger.info('{} messages sent in {:.3f} s, {:.0f} messages/s'.format(
+                sent, seconds, sent / seconds if seconds else 0))
+        # Blocks until every queued message is delivered
+        socket.close()
+        context.term()
+    except KeyboardInterrupt:
+        sys.exit(1)
+    except (OSError, RecordingError, zmq.ZMQError) as e:
+        logger.critical(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()